@@ -0,0 +1,353 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Benchmark every collector in this repo against synthetic data sources
+
+Each collector runs in a fresh child process: one warm-up collect() (which
+fills caches and, for ProcessCpuCollector, takes the initial cputime
+samples, sleeping 100ms per matched pid), then `--iterations` timed collect()
+calls. Reported per collect():
+
+ * wall: mean wall time in milliseconds
+ * syscr/syscw: read and write syscalls, from /proc/self/io
+ * rchar: bytes read, from /proc/self/io
+ * nvcsw: voluntary context switches, a proxy for blocking network I/O
+   (socket recv/send are not counted in /proc/self/io)
+ * peak_kb: peak RSS (VmHWM) reached during the timed calls
+ * metrics: metrics handed to publish_metric()
+
+A collector that logs an error or publishes nothing but its collector.*
+stats is reported as FAILED and the script exits non-zero, so a missing
+dependency or broken fixture cannot pass for a fast collector.
+
+    python benchmarks/bench_collectors.py --pids 5000 --threads 8
+    python benchmarks/bench_collectors.py processcpu numastat
+    python benchmarks/bench_collectors.py --async-fetch civet
+"""
+
+import logging
+import multiprocessing
+import optparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Mirror diamond's load_include_path() so collectors import as they would
+# inside diamond.
+for _name in sorted(os.listdir(ROOT)):
+    if os.path.isdir(os.path.join(ROOT, _name)) and _name[0] != '.':
+        sys.path.insert(1, os.path.join(ROOT, _name))
+
+import configobj
+
+import fixtures
+
+
+def collector_config(name, values):
+    config = configobj.ConfigObj()
+    config['server'] = {'collectors_config_path': ''}
+    config['collectors'] = {'default': {'hostname_method': 'uname_short'},
+                            name: values}
+    return config
+
+
+def read_proc_io():
+    io = {}
+    with open('/proc/self/io') as fp:
+        for line in fp:
+            key, value = line.split(':')
+            io[key] = int(value)
+    return io
+
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux >= 4.0)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except IOError:
+        pass
+
+
+def read_peak_rss():
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class ErrorRecorder(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def check_collection(errors, data_metrics=None):
+    if errors.messages:
+        raise BenchmarkError('collect() logged %d error(s), first: %s'
+                             % (len(errors.messages), errors.messages[0]))
+    if data_metrics == 0:
+        raise BenchmarkError('collect() published no metrics')
+
+
+def measure(collector, iterations):
+    counter = [0]
+    data_counter = [0]
+    stats_path = collector.get_metric_path('collector.')
+
+    def publish_metric(metric):
+        counter[0] += 1
+        if not metric.path.startswith(stats_path):
+            data_counter[0] += 1
+    collector.publish_metric = publish_metric
+
+    errors = ErrorRecorder()
+    collector.log.addHandler(errors)
+
+    # The warm-up may only record baselines, so just check for errors
+    collector.collect()
+    check_collection(errors)
+    counter[0] = 0
+    data_counter[0] = 0
+
+    reset_peak_rss()
+    before = read_proc_io()
+    nvcsw = resource.getrusage(resource.RUSAGE_SELF).ru_nvcsw
+    start = time.time()
+    for _ in xrange(iterations):
+        collector.collect()
+    wall = time.time() - start
+    nvcsw = resource.getrusage(resource.RUSAGE_SELF).ru_nvcsw - nvcsw
+    after = read_proc_io()
+    check_collection(errors, data_counter[0])
+
+    return {
+        'wall': wall * 1000.0 / iterations,
+        'syscr': (after['syscr'] - before['syscr']) / iterations,
+        'syscw': (after['syscw'] - before['syscw']) / iterations,
+        'rchar': (after['rchar'] - before['rchar']) / iterations,
+        'nvcsw': nvcsw / iterations,
+        'peak_kb': read_peak_rss(),
+        'metrics': counter[0] / iterations,
+    }
+
+
+###############################################################################
+# Benchmark cases. Each takes (options, workdir) and returns a collector
+# wired to its synthetic data source, plus a cleanup callable.
+
+
+def case_processcpu(options, workdir):
+    from processcpu import ProcessCpuCollector
+
+    proc = os.path.join(workdir, 'proc')
+    pids = fixtures.make_proc_tree(proc, options.pids, options.threads)
+    pidfile = os.path.join(workdir, 'nginx.pid')
+    with open(pidfile, 'w') as fp:
+        fp.write(''.join('%d\n' % pid for pid in pids[1::8]))
+
+    ProcessCpuCollector.PROC = proc
+    collector = ProcessCpuCollector(collector_config('ProcessCpuCollector', {
+        'process': {
+            'haproxy': {'cmdline': r'haproxy.* -f /etc/haproxy/'},
+            'nginx': {'pidfile': pidfile},
+            'java': {'exe': '*/bin/java'},
+        },
+    }), None)
+    return collector, lambda: None
+
+
+def case_processcpu_discover(options, workdir):
+    from processcpu import ProcessCpuCollector
+
+    proc = os.path.join(workdir, 'proc')
+    fixtures.make_proc_tree(proc, options.pids, options.threads)
+
+    ProcessCpuCollector.PROC = proc
+    collector = ProcessCpuCollector(collector_config('ProcessCpuCollector', {
+        'discover': True,
+    }), None)
+
+    # Discovery publishes nothing until system cputime moves between
+    # collections; this adds one small write per collect()
+    collect = collector.collect
+
+    def ticking_collect():
+        fixtures.advance_proc_stat(proc)
+        collect()
+    collector.collect = ticking_collect
+    return collector, lambda: None
+
+
+def case_numastat(options, workdir):
+    from numastat import NumastatCollector
+
+    node = fixtures.make_numa_sysfs(os.path.join(workdir, 'node'),
+                                    options.nodes, options.counters)
+    NumastatCollector.NODE = node
+    collector = NumastatCollector(
+        collector_config('NumastatCollector', {}), None)
+    return collector, lambda: None
+
+
+def case_civet(options, workdir):
+    from civet_collector import CivetCollector
+
+    stub = fixtures.CivetStub(options.handlers, options.stats).start()
+    collector = CivetCollector(collector_config('CivetCollector', {
+        'port': stub.port,
+        'async_fetch': options.async_fetch,
+    }), None)
+    return collector, stub.stop
+
+
+def case_nginxpushstream(options, workdir):
+    from nginxpushstream import NginxPushStreamCollector
+
+    stubs = [fixtures.PushStreamStub().start()
+             for _ in xrange(options.instances)]
+    values = {'async_fetch': options.async_fetch}
+    if options.instances == 1:
+        values['port'] = stubs[0].port
+    else:
+        values['endpoints'] = ['127.0.0.1:%d' % stub.port for stub in stubs]
+
+    collector = NginxPushStreamCollector(
+        collector_config('NginxPushStreamCollector', values), None)
+
+    def cleanup():
+        for stub in stubs:
+            stub.stop()
+    return collector, cleanup
+
+
+def case_storm_kafka_monitor(options, workdir):
+    import storm_kafka_monitor
+    from storm_kafka_monitor import StormKafkaMonitorCollector
+
+    if storm_kafka_monitor.IMPORT_ERROR is not None:
+        raise BenchmarkError('missing dependency: %s'
+                             % storm_kafka_monitor.IMPORT_ERROR)
+
+    collector = StormKafkaMonitorCollector(
+        collector_config('StormKafkaMonitorCollector', {
+            'async_fetch': options.async_fetch,
+        }), None)
+    cluster = collector.get_clusters()[0]
+    cluster.zk = fixtures.make_storm_zk(options.topologies,
+                                        options.partitions,
+                                        options.brokers)
+    for b in xrange(options.brokers):
+        cluster.kafka_clients[('broker%d.i.disqus.net' % b, 9092)] = \
+            fixtures.FakeKafkaClient()
+    return collector, lambda: None
+
+
+def case_kafka_consumer_offsets(options, workdir):
+    from kafka_consumer_offsets import KafkaConsumerOffsetsCollector
+
+    collector = KafkaConsumerOffsetsCollector(
+        collector_config('KafkaConsumerOffsetsCollector', {
+            'async_fetch': options.async_fetch,
+        }), None)
+    collector._zk = fixtures.make_consumer_zk(options.groups,
+                                              options.topologies,
+                                              options.partitions)
+    return collector, lambda: None
+
+
+CASES = [
+    ('processcpu', case_processcpu),
+    ('processcpu_discover', case_processcpu_discover),
+    ('numastat', case_numastat),
+    ('civet', case_civet),
+    ('nginxpushstream', case_nginxpushstream),
+    ('storm_kafka_monitor', case_storm_kafka_monitor),
+    ('kafka_consumer_offsets', case_kafka_consumer_offsets),
+]
+
+
+###############################################################################
+
+
+def run_case(case, options, conn):
+    workdir = tempfile.mkdtemp(prefix='bench-collectors-')
+    cleanup = None
+    try:
+        collector, cleanup = case(options, workdir)
+        conn.send(measure(collector, options.iterations))
+    except BenchmarkError, err:
+        conn.send({'error': str(err)})
+    except Exception, err:
+        conn.send({'error': '%s: %s' % (err.__class__.__name__, err)})
+    finally:
+        if cleanup is not None:
+            cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [collector ...]')
+    parser.add_option('--iterations', type='int', default=10)
+    parser.add_option('--async-fetch', action='store_true', default=False,
+                      help="Enable async_fetch on the network collectors")
+    parser.add_option('--pids', type='int', default=500)
+    parser.add_option('--threads', type='int', default=4)
+    parser.add_option('--nodes', type='int', default=4)
+    parser.add_option('--counters', type='int', default=6)
+    parser.add_option('--handlers', type='int', default=50)
+    parser.add_option('--stats', type='int', default=10)
+    parser.add_option('--instances', type='int', default=1,
+                      help="push-stream status endpoints to aggregate")
+    parser.add_option('--topologies', type='int', default=10)
+    parser.add_option('--partitions', type='int', default=100)
+    parser.add_option('--brokers', type='int', default=8)
+    parser.add_option('--groups', type='int', default=10)
+    options, names = parser.parse_args()
+
+    print '%-24s %10s %8s %8s %10s %7s %9s %8s' % (
+        'collector', 'wall_ms', 'syscr', 'syscw', 'rchar', 'nvcsw',
+        'peak_kb', 'metrics')
+
+    failed = 0
+    for name, case in CASES:
+        if names and name not in names:
+            continue
+
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_case,
+                                          args=(case, options, child))
+        process.start()
+        result = parent.recv()
+        process.join()
+
+        if 'error' in result:
+            print '%-24s FAILED: %s' % (name, result['error'])
+            failed += 1
+            continue
+
+        print '%-24s %10.3f %8d %8d %10d %7d %9d %8d' % (
+            name, result['wall'], result['syscr'], result['syscw'],
+            result['rchar'], result['nvcsw'], result['peak_kb'],
+            result['metrics'])
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
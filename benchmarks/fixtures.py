@@ -0,0 +1,330 @@
+# coding=utf-8
+
+"""
+Synthetic data sources for the collector benchmarks
+
+ * make_proc_tree: a /proc lookalike with configurable pid and thread counts
+ * make_numa_sysfs: a /sys/devices/system/node lookalike
+ * CivetStub: a TCP server answering civet's `sample` command
+ * PushStreamStub: an HTTP server serving push_stream_channel_statistics
+ * FakeZk / FakeKafkaClient: in-memory stand-ins for kazoo and kafka-python
+
+The network stubs run in their own process so their I/O does not show up in
+the benchmarked process's /proc/self/io counters.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import multiprocessing
+import os
+import random
+from collections import namedtuple
+
+try:
+    import json
+    json  # workaround for pyflakes issue #13
+except ImportError:
+    import simplejson as json
+
+ZkStat = namedtuple('ZkStat', ['mzxid', 'version'])
+OffsetResponse = namedtuple('OffsetResponse',
+                            ['topic', 'partition', 'error', 'offsets'])
+
+# Process names cycled through the synthetic /proc tree. Some contain spaces
+# and parentheses to exercise comm parsing.
+COMMS = ['haproxy', 'nginx', 'python', 'java', 'kworker/0:1', 'sshd',
+         'tmux: server', 'weird ) (name']
+UNITS = ['haproxy.service', 'nginx.service', 'app.service',
+         'docker-4f1c2d3e5a6b.scope', 'user@1000.service']
+
+
+def _write(path, data):
+    with open(path, 'w') as fp:
+        fp.write(data)
+
+
+def _stat_line(pid, comm, utime, stime, starttime):
+    # pid (comm) state ppid pgrp session tty_nr tpgid flags minflt cminflt
+    # majflt cmajflt utime stime cutime cstime priority nice num_threads
+    # itrealvalue starttime vsize rss ... (52 fields in total)
+    fields = ['S', '1', str(pid), str(pid), '0', '-1', '4202752', '1500',
+              '0', '3', '0', str(utime), str(stime), '0', '0', '20', '0',
+              '1', '0', str(starttime), '104857600', '2048']
+    fields.extend(['0'] * (50 - len(fields)))
+    return '%d (%s) %s\n' % (pid, comm, ' '.join(fields))
+
+
+def make_proc_tree(root, pids=1000, threads=4, seed=0):
+    """Build a synthetic /proc under root.
+
+    Every pid gets stat, cmdline, cgroup, an exe symlink and `threads`
+    task/<tid>/stat entries. Returns the list of pids written.
+
+    """
+    rand = random.Random(seed)
+    os.makedirs(root)
+
+    _write(os.path.join(root, 'stat'),
+           'cpu  %s\n' % ' '.join(str(rand.randint(10 ** 6, 10 ** 8))
+                                  for _ in xrange(10)))
+
+    written = []
+    for i in xrange(pids):
+        pid = 100 + i
+        comm = COMMS[i % len(COMMS)]
+        unit = UNITS[i % len(UNITS)]
+        proc = os.path.join(root, str(pid))
+        os.makedirs(os.path.join(proc, 'task'))
+
+        utime, stime = rand.randint(0, 10 ** 6), rand.randint(0, 10 ** 6)
+        starttime = rand.randint(0, 10 ** 7)
+        _write(os.path.join(proc, 'stat'),
+               _stat_line(pid, comm, utime, stime, starttime))
+        _write(os.path.join(proc, 'cmdline'),
+               '\x00'.join(['/usr/local/bin/%s' % comm.split()[0],
+                            '-f', '/etc/%s/%d.cfg' % (comm.split()[0], i),
+                            '']))
+        _write(os.path.join(proc, 'cgroup'),
+               '12:cpu,cpuacct:/system.slice/%s\n1:name=systemd:'
+               '/system.slice/%s\n0::/system.slice/%s\n' % (unit, unit, unit))
+        os.symlink('/usr/local/bin/%s' % comm.split()[0],
+                   os.path.join(proc, 'exe'))
+
+        for t in xrange(threads):
+            task = os.path.join(proc, 'task', str(pid + t * pids))
+            os.makedirs(task)
+            _write(os.path.join(task, 'stat'),
+                   _stat_line(pid + t * pids, comm, utime, stime, starttime))
+
+        written.append(pid)
+
+    return written
+
+
+def advance_proc_stat(root, jiffies=100):
+    """Add jiffies of user time to the cpu line of root/stat."""
+    path = os.path.join(root, 'stat')
+    with open(path) as fp:
+        fields = fp.read().split()
+    fields[1] = str(int(fields[1]) + jiffies)
+    _write(path, 'cpu  %s\n' % ' '.join(fields[1:]))
+
+
+def make_numa_sysfs(root, nodes=4, counters=6, seed=0):
+    """Build a synthetic /sys/devices/system/node under root."""
+    rand = random.Random(seed)
+    names = ['numa_hit', 'numa_miss', 'numa_foreign', 'interleave_hit',
+             'local_node', 'other_node']
+    names.extend('extra_counter_%d' % i for i in xrange(counters - 6))
+
+    for node in xrange(nodes):
+        path = os.path.join(root, 'node%d' % node)
+        os.makedirs(path)
+        _write(os.path.join(path, 'numastat'),
+               ''.join('%s %d\n' % (name, rand.randint(0, 10 ** 9))
+                       for name in names[:counters]))
+    return root
+
+
+class _StubProcess(object):
+    """Run a SocketServer in a child process bound to an ephemeral port."""
+
+    def __init__(self):
+        self.port = None
+        self._process = None
+
+    def make_server(self):
+        raise NotImplementedError()
+
+    def _serve(self, conn):
+        server = self.make_server()
+        conn.send(server.server_address[1])
+        server.serve_forever()
+
+    def start(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=self._serve,
+                                                args=(child,))
+        self._process.daemon = True
+        self._process.start()
+        self.port = parent.recv()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+
+class CivetStub(_StubProcess):
+    """Answer `sample` with `handlers` x `stats` JSON counters."""
+
+    def __init__(self, handlers=20, stats=10):
+        super(CivetStub, self).__init__()
+        self.payload = json.dumps(dict(
+            ('handler%d' % h, dict(('stat%d' % s, h * s)
+                                   for s in xrange(stats)))
+            for h in xrange(handlers)))
+
+    def make_server(self):
+        payload = self.payload
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                self.rfile.readline()
+                self.wfile.write(payload)
+
+        SocketServer.TCPServer.allow_reuse_address = True
+        return SocketServer.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+
+
+class PushStreamStub(_StubProcess):
+    """Serve a push_stream_channel_statistics summary on any location."""
+
+    def __init__(self, subscribers=1000):
+        super(PushStreamStub, self).__init__()
+        self.payload = json.dumps({
+            'hostname': 'bench',
+            'time': '2013-01-01T00:00:00',
+            'channels': 100,
+            'broadcast_channels': 2,
+            'published_messages': 123456,
+            'stored_messages': 100,
+            'messages_in_trash': 0,
+            'channels_in_trash': 0,
+            'subscribers': subscribers,
+            'uptime': 3600,
+            'by_worker': [{'pid': 1, 'subscribers': subscribers,
+                           'uptime': 3600}],
+        })
+
+    def make_server(self):
+        payload = self.payload
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+
+
+class FakeAsyncResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, block=True, timeout=None):
+        return self.value
+
+
+class FakeZk(object):
+    """In-memory subset of the KazooClient API used by the collectors."""
+
+    def __init__(self):
+        self.connected = True
+        self._zxid = 0
+        # path -> [data, mzxid, version]
+        self._nodes = {'/': ['', 0, 0]}
+        self._children = {'/': set()}
+
+    def create(self, path, data=''):
+        parent = path.rsplit('/', 1)[0] or '/'
+        if parent not in self._nodes:
+            self.create(parent)
+        self._zxid += 1
+        self._nodes[path] = [data, self._zxid, 0]
+        self._children.setdefault(path, set())
+        self._children[parent].add(path.rsplit('/', 1)[1])
+
+    def set(self, path, data):
+        self._zxid += 1
+        node = self._nodes[path]
+        node[0], node[1], node[2] = data, self._zxid, node[2] + 1
+
+    def start(self, timeout=None):
+        self.connected = True
+
+    def stop(self):
+        self.connected = False
+
+    def get_children(self, path):
+        return list(self._children[path])
+
+    def exists(self, path):
+        node = self._nodes.get(path)
+        if node is None:
+            return None
+        return ZkStat(node[1], node[2])
+
+    def get(self, path):
+        node = self._nodes[path]
+        return node[0], ZkStat(node[1], node[2])
+
+    def exists_async(self, path):
+        return FakeAsyncResult(self.exists(path))
+
+    def get_async(self, path):
+        return FakeAsyncResult(self.get(path))
+
+    def get_children_async(self, path):
+        return FakeAsyncResult(self.get_children(path))
+
+
+def make_storm_zk(topologies=10, partitions=100, brokers=8):
+    """Populate a FakeZk with running topologies and spout state nodes."""
+    zk = FakeZk()
+    for t in xrange(topologies):
+        zk.create('/storm/storms/topology%d-1-1370000000' % t)
+        for p in xrange(partitions):
+            zk.create('/kafkastorm/topology%d_partition_%d' % (t, p),
+                      json.dumps({
+                          'topology': {'id': 'topology%d-1' % t,
+                                       'name': 'topology%d' % t},
+                          'offset': 1000 + p,
+                          'partition': p,
+                          'topic': 'topic%d' % t,
+                          'broker': {'host': 'broker%d.i.disqus.net' %
+                                     (p % brokers),
+                                     'port': 9092},
+                      }))
+    return zk
+
+
+def make_consumer_zk(groups=10, topics=5, partitions=20):
+    """Populate a FakeZk with kafka consumer group offsets."""
+    zk = FakeZk()
+    for g in xrange(groups):
+        zk.create('/consumers/group%d/ids/consumer%d' % (g, g))
+        for t in xrange(topics):
+            for p in xrange(partitions):
+                zk.create('/consumers/group%d/offsets/topic%d/%d' % (g, t, p),
+                          str(1000 * p))
+    return zk
+
+
+class FakeKafkaClient(object):
+    """Answer offset requests with deterministic offsets.
+
+    Like kafka-python, payloads are keyed by (topic, partition): a later
+    payload for a partition replaces an earlier one in the same request.
+
+    """
+
+    def __init__(self, host=None, port=None):
+        self.host = host
+        self.port = port
+
+    def send_offset_request(self, payloads):
+        requests = dict(((p.topic, p.partition), p) for p in payloads)
+        responses = {}
+        for key, p in requests.iteritems():
+            responses[key] = OffsetResponse(p.topic, p.partition, 0,
+                                            [5000 if p.time == -1 else 0])
+        return [responses[(p.topic, p.partition)] for p in payloads]
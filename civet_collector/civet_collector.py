@@ -19,15 +19,24 @@ except ImportError:
     import simplejson as json
 
 import diamond.collector
+from diamond.collector import str_to_bool
 
+from asyncfetch import FetchError, TCPFetch, fetch_all
+from collectorstats import CollectorStatsMixin, instrumented
+from metricbatch import MetricBatch
+from pollschedule import PollScheduleMixin, scheduled
 
-class CivetCollector(diamond.collector.Collector):
+
+class CivetCollector(CollectorStatsMixin, PollScheduleMixin,
+                     diamond.collector.Collector):
 
     def get_default_config_help(self):
         config_help = super(CivetCollector, self).get_default_config_help()
         config_help.update({
             'host': "",
             'port': "",
+            'async_fetch': "Fetch through the asyncore event loop instead "
+                           "of a blocking socket",
         })
         return config_help
 
@@ -41,6 +50,8 @@ class CivetCollector(diamond.collector.Collector):
             'port':     7201,
             'path':     'civet',
             'method':   'Threaded',
+            'timeout':  1,
+            'async_fetch': False,
         })
         return config
 
@@ -50,43 +61,73 @@ class CivetCollector(diamond.collector.Collector):
         s = None
         address = (self.config['host'], int(self.config['port']))
 
+        if not self.endpoint_ready(address):
+            return None
+
         try:
-            s = socket.create_connection(address, timeout=1)
-
-            s.sendall('sample\n')
-
-            while 1:
-                data = s.recv(4096)
-                if not data:
-                    break
-                json_string += data
-        except socket.error:
-            self.log.exception("Error when talking to civet")
-            return ''
+            if str_to_bool(self.config['async_fetch']):
+                json_string = self.fetch_async(address)
+            else:
+                s = socket.create_connection(address,
+                                             timeout=self.request_timeout())
+
+                s.sendall('sample\n')
+
+                while 1:
+                    s.settimeout(self.request_timeout())
+                    data = s.recv(4096)
+                    if not data:
+                        break
+                    json_string += data
+        except (socket.error, FetchError):
+            self.endpoint_failed(address, "Error when talking to civet")
+            return None
         finally:
             if s:
                 s.close()
 
         return json_string
 
+    def fetch_async(self, address):
+        fetch, = fetch_all([
+            TCPFetch(address, 'sample\n', self.request_timeout())])
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.result()
+
     def get_data(self):
-        json_string = self.get_json()
+        with self.timed('fetch'):
+            json_string = self.get_json()
+        if json_string is None:
+            return None
+        self.count_bytes('response', len(json_string))
 
+        address = (self.config['host'], int(self.config['port']))
         try:
-            data = json.loads(json_string)
+            with self.timed('parse'):
+                data = json.loads(json_string)
         except (ValueError, TypeError):
-            self.log.exception("Error parsing json from civet")
+            self.endpoint_failed(address, "Error parsing json from civet")
             return None
 
+        # Only a parsed response counts as a success for the backoff
+        self.endpoint_succeeded(address)
         return data
 
+    @scheduled
+    @instrumented
     def collect(self):
         data = self.get_data()
 
         if not data:
             return
 
-        for handler, stats in data.iteritems():
-            for stat, value in stats.iteritems():
-                metric = '.'.join([handler, stat])
-                self.publish(metric, value)
+        self.count_items('handlers', len(data))
+
+        with self.timed('publish'):
+            batch = MetricBatch.for_collector(self)
+            for handler, stats in data.iteritems():
+                prefix = handler + '.'
+                for stat, value in stats.iteritems():
+                    batch.add(prefix + stat, value)
+            batch.flush()
@@ -0,0 +1,179 @@
+# coding=utf-8
+
+"""
+Fetch from many network endpoints concurrently in one thread
+
+An asyncore event loop drives any number of request/response exchanges over
+TCP, each with its own timeout, so a collector polling dozens of targets
+needs neither a thread per target nor to wait on them one after another.
+
+    from asyncfetch import TCPFetch, HTTPFetch, fetch_all
+
+    fetches = fetch_all([
+        TCPFetch(('127.0.0.1', 7201), 'sample\\n', timeout=1),
+        HTTPFetch('10.0.0.1', 80, '/push-stream-status', timeout=5),
+    ])
+    for fetch in fetches:
+        if fetch.error is None:
+            handle(fetch.result())
+
+A TCPFetch sends its payload and reads until the server closes the
+connection. An HTTPFetch sends an HTTP/1.0 GET and its result() is the
+response body; a non-2xx status is reported as an HTTPStatusError.
+
+ZooKeeper reads go through kazoo's own async API instead: zk_pipeline()
+issues every request before waiting on any, so N reads cost about one round
+trip rather than N.
+
+    stats = zk_pipeline(zk, 'exists', paths, timeout=5)
+"""
+
+import asyncore
+import socket
+import sys
+import time
+
+__all__ = ['FetchError', 'HTTPStatusError', 'TCPFetch', 'HTTPFetch',
+           'fetch_all', 'zk_pipeline']
+
+
+class FetchError(Exception):
+    pass
+
+
+class HTTPStatusError(FetchError):
+    def __init__(self, code, body):
+        FetchError.__init__(self, 'HTTP %s' % code)
+        self.code = code
+        self.body = body
+
+
+class TCPFetch(asyncore.dispatcher):
+    """Send payload to address and read the response until EOF."""
+
+    def __init__(self, address, payload, timeout):
+        asyncore.dispatcher.__init__(self, map={})
+        self.address = address
+        self.timeout = timeout
+        self.error = None
+        self.done = False
+
+        self._out = payload
+        self._in = []
+        self._deadline = None
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__,
+                               self.address[0], self.address[1])
+
+    def start(self, socket_map):
+        """Start connecting, registering in socket_map."""
+        self._map = socket_map
+        self._deadline = time.time() + self.timeout
+        try:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.connect(self.address)
+        except socket.error, err:
+            self.fail(err)
+
+    def fail(self, error):
+        if not self.done:
+            self.error = error
+            self.done = True
+        self.close()
+
+    def expired(self, now):
+        return now >= self._deadline
+
+    @property
+    def data(self):
+        return ''.join(self._in)
+
+    def result(self):
+        return self.data
+
+    # asyncore callbacks
+
+    def handle_connect(self):
+        pass
+
+    def writable(self):
+        return not self.connected or bool(self._out)
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+
+    def handle_read(self):
+        chunk = self.recv(4096)
+        if chunk:
+            self._in.append(chunk)
+
+    def handle_close(self):
+        self.done = True
+        self.close()
+
+    def handle_error(self):
+        self.fail(sys.exc_info()[1])
+
+    def handle_expt(self):
+        self.fail(socket.error('exceptional condition on %s:%s'
+                               % self.address))
+
+
+class HTTPFetch(TCPFetch):
+    """GET location from host:port over HTTP/1.0."""
+
+    def __init__(self, host, port, location, timeout):
+        request = ('GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n'
+                   % (location, host))
+        TCPFetch.__init__(self, (host, int(port)), request, timeout)
+        self.url = 'http://%s:%s%s' % (host, port, location)
+
+    def result(self):
+        """Return the response body, raising HTTPStatusError on non-2xx."""
+        head, _, body = self.data.partition('\r\n\r\n')
+        status = head.split('\r\n', 1)[0].split()
+        if len(status) < 2 or not status[1].isdigit():
+            raise FetchError('malformed response from %s' % self.url)
+        code = int(status[1])
+        if not 200 <= code < 300:
+            raise HTTPStatusError(code, body)
+        return body
+
+
+def fetch_all(fetches, poll=0.05):
+    """Run every fetch to completion or timeout and return them.
+
+    A fetch that runs past its timeout has error set to socket.timeout.
+    """
+    socket_map = {}
+    for fetch in fetches:
+        fetch.start(socket_map)
+
+    pending = [fetch for fetch in fetches if not fetch.done]
+    while pending:
+        asyncore.loop(timeout=poll, map=socket_map, count=1)
+
+        now = time.time()
+        for fetch in pending:
+            if not fetch.done and fetch.expired(now):
+                fetch.fail(socket.timeout('timed out talking to %s:%s'
+                                          % fetch.address))
+        pending = [fetch for fetch in pending if not fetch.done]
+
+    return fetches
+
+
+def zk_pipeline(zk, method, paths, timeout):
+    """Call zk.<method>(path) for every path through kazoo's async API.
+
+    All requests are sent before waiting on the first reply. Returns the
+    results in the order of paths; raises the first error encountered, or
+    kazoo's timeout error once timeout seconds have passed.
+    """
+    deadline = time.time() + timeout
+    call = getattr(zk, method + '_async')
+    results = [call(path) for path in paths]
+    return [result.get(timeout=max(deadline - time.time(), 0))
+            for result in results]
@@ -0,0 +1,128 @@
+# coding=utf-8
+
+"""
+Self-instrumentation for collectors
+
+CollectorStatsMixin times the phases of a collection and counts the items
+and bytes it handled, then publishes them under the collector's own path:
+
+    <path>.collector.time.total           collect() wall time, ms
+    <path>.collector.time.<phase>         time spent in each phase, ms
+    <path>.collector.items.<name>         items seen this collection
+    <path>.collector.bytes.<name>         bytes read this collection
+
+    from collectorstats import CollectorStatsMixin, instrumented
+
+    class FooCollector(CollectorStatsMixin, diamond.collector.Collector):
+
+        @instrumented
+        def collect(self):
+            with self.timed('fetch'):
+                data = self.get_json()
+            self.count_bytes('response', len(data))
+
+Phases timed from several threads add up, so a phase can report more time
+than the collection's total. Set `collector_stats = False` to turn it off.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from diamond.collector import str_to_bool
+
+from metricbatch import MetricBatch
+
+__all__ = ['CollectorStatsMixin', 'instrumented']
+
+
+def instrumented(collect):
+    """Decorate collect() to time it and publish the collector stats."""
+    @wraps(collect)
+    def wrapper(self):
+        self.reset_collector_stats()
+        start = time.time()
+        try:
+            return collect(self)
+        finally:
+            self.add_time('total', time.time() - start)
+            self.publish_collector_stats()
+    return wrapper
+
+
+class CollectorStatsMixin(object):
+    """Phase timing and item/byte counters for a diamond collector.
+
+    Must come before diamond.collector.Collector in the bases so its
+    get_default_config() is picked up.
+
+    """
+    def get_default_config_help(self):
+        config_help = super(CollectorStatsMixin,
+                            self).get_default_config_help()
+        config_help.update({
+            'collector_stats': "Publish timing and counters of the "
+                               "collector itself under collector.*",
+        })
+        return config_help
+
+    def get_default_config(self):
+        config = super(CollectorStatsMixin, self).get_default_config()
+        config.update({
+            'collector_stats': True,
+        })
+        return config
+
+    def _collector_stats(self):
+        """Return the stats lock and dict, both created once so threads
+        still running from an earlier collection keep using the same ones.
+
+        """
+        lock = self.__dict__.setdefault('_stats_lock', threading.Lock())
+        stats = self.__dict__.setdefault('_stats', {})
+        return lock, stats
+
+    def reset_collector_stats(self):
+        lock, stats = self._collector_stats()
+        with lock:
+            stats.clear()
+
+    def _add_stat(self, key, value):
+        lock, stats = self._collector_stats()
+        with lock:
+            stats[key] = stats.get(key, 0) + value
+
+    def add_time(self, phase, seconds):
+        self._add_stat('time.' + phase, seconds * 1000.0)
+
+    @contextmanager
+    def timed(self, phase):
+        """Add the time spent in the with block to phase."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def count_items(self, name, count=1):
+        self._add_stat('items.' + name, count)
+
+    def count_bytes(self, name, count):
+        self._add_stat('bytes.' + name, count)
+
+    def publish_collector_stats(self):
+        if not str_to_bool(self.config['collector_stats']):
+            return
+
+        lock, stats = self._collector_stats()
+        with lock:
+            stats = sorted(stats.iteritems())
+        if not stats:
+            return
+
+        batch = MetricBatch.for_collector(self)
+        for key, value in stats:
+            batch.add('collector.' + key, value,
+                      precision=3 if key.startswith('time.') else 0)
+        batch.flush()
@@ -0,0 +1,147 @@
+# coding=utf-8
+
+"""
+Accumulate a collection's metrics and publish them in a single pass
+
+Collector.publish() re-checks the whitelist/blacklist, rebuilds the full
+metric path and looks up the hostname and ttl for every value. MetricBatch
+resolves each metric name to its interned path once and reuses it on every
+later collection, and publishes the whole batch with one timestamp, host and
+ttl.
+
+    from metricbatch import MetricBatch
+
+    def collect(self):
+        batch = MetricBatch.for_collector(self)
+        for name, value in self.get_data():
+            batch.add(name, value)
+        batch.flush()
+
+Diamond has no bulk publish API, so flush() still hands metrics to
+publish_metric() one at a time; only the per-metric work in front of it is
+amortized.
+
+Setting `dedup_heartbeat` in a collector's config passes every flush through
+a MetricDedup, which drops values unchanged since they were last published
+(see metricdedup).
+"""
+
+import time
+
+from diamond.error import DiamondException
+from diamond.metric import Metric
+
+from metricdedup import MetricDedup
+
+__all__ = ['MetricBatch']
+
+
+class MetricBatch(object):
+    """Batch of (name, value) pairs pending publication for a collector.
+
+    Resolved paths are kept for up to max_paths distinct names; the cache is
+    dropped and rebuilt if a collector emits more than that.
+
+    """
+    def __init__(self, collector, max_paths=100000):
+        self.collector = collector
+        self.max_paths = max_paths
+        self.dedup = None
+
+        # metric name -> interned full path, None if filtered out
+        self._paths = {}
+        # (name, value, raw_value, precision, metric_type)
+        self._metrics = []
+
+    @classmethod
+    def for_collector(cls, collector):
+        """Return the batch attached to collector, creating it once."""
+        batch = getattr(collector, '_metric_batch', None)
+        if batch is None:
+            batch = collector._metric_batch = cls(collector)
+            heartbeat = int(collector.config.get('dedup_heartbeat') or 0)
+            if heartbeat > 0:
+                batch.dedup = MetricDedup(
+                    heartbeat, float(collector.config['interval']))
+        return batch
+
+    def __len__(self):
+        return len(self._metrics)
+
+    def path(self, name):
+        """Return the interned metric path of name, or None if the
+        collector's whitelist/blacklist filters it out.
+
+        """
+        try:
+            return self._paths[name]
+        except KeyError:
+            pass
+
+        config = self.collector.config
+        if config['metrics_whitelist']:
+            allowed = config['metrics_whitelist'].match(name)
+        elif config['metrics_blacklist']:
+            allowed = not config['metrics_blacklist'].match(name)
+        else:
+            allowed = True
+
+        if allowed:
+            path = self.collector.get_metric_path(name)
+            # Names parsed from JSON are unicode, which intern() rejects
+            if isinstance(path, str):
+                path = intern(path)
+        else:
+            path = None
+
+        if len(self._paths) >= self.max_paths:
+            self._paths.clear()
+        self._paths[name] = path
+        return path
+
+    def add(self, name, value, raw_value=None, precision=0,
+            metric_type='GAUGE'):
+        """Queue a metric; arguments match Collector.publish()."""
+        self._metrics.append((name, value, raw_value, precision, metric_type))
+
+    def flush(self):
+        """Publish every queued metric and empty the batch.
+
+        Returns the number of metrics published.
+
+        """
+        collector = self.collector
+        publish_metric = collector.publish_metric
+        path_of = self.path
+        dedup = self.dedup
+
+        timestamp = int(time.time())
+        host = collector.get_hostname()
+        ttl = float(collector.config['interval']) * float(
+            collector.config['ttl_multiplier'])
+
+        published = 0
+        for name, value, raw_value, precision, metric_type in self._metrics:
+            path = path_of(name)
+            if path is None:
+                continue
+            if dedup is not None and not dedup.should_publish(path, value,
+                                                              timestamp):
+                continue
+
+            try:
+                metric = Metric(path, value, raw_value=raw_value,
+                                timestamp=timestamp, precision=precision,
+                                host=host, metric_type=metric_type, ttl=ttl)
+            except DiamondException:
+                collector.log.error(('Error when creating new Metric: '
+                                     'path=%r, value=%r'), path, value)
+                continue
+
+            publish_metric(metric)
+            published += 1
+
+        if dedup is not None:
+            dedup.prune(timestamp)
+        del self._metrics[:]
+        return published
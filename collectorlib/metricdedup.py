@@ -0,0 +1,66 @@
+# coding=utf-8
+
+"""
+Suppress re-publishing of unchanged metric values
+
+MetricDedup remembers the last value published for each metric path and
+only lets a metric through when its value changed, or when it has not been
+sent for `heartbeat` collection intervals, so idle counters still reach
+graphite often enough to keep their series alive.
+
+MetricBatch applies it to every flush when the collector's config sets
+`dedup_heartbeat` to a positive number of intervals:
+
+```
+[[NumastatCollector]]
+dedup_heartbeat = 10
+```
+
+Graphs of deduplicated series have gaps between heartbeats; draw them with
+keepLastValue() or a `xFilesFactor` of 0.
+"""
+
+__all__ = ['MetricDedup']
+
+
+class MetricDedup(object):
+    """Last published value and time per metric path.
+
+    A value is re-sent once it is older than (heartbeat - 0.5) intervals,
+    which tolerates collections running slightly early or late.
+
+    """
+    def __init__(self, heartbeat, interval):
+        self.max_age = (heartbeat - 0.5) * interval
+        self.suppressed = 0
+
+        # path -> (value, timestamp last published)
+        self._last = {}
+        self._pruned_at = 0
+
+    def __len__(self):
+        return len(self._last)
+
+    def should_publish(self, path, value, now):
+        last = self._last.get(path)
+        if (last is not None and last[0] == value
+                and now - last[1] < self.max_age):
+            self.suppressed += 1
+            return False
+
+        self._last[path] = (value, now)
+        return True
+
+    def prune(self, now):
+        """Forget paths not published for two heartbeats, at most once per
+        heartbeat.
+
+        """
+        if now - self._pruned_at < self.max_age:
+            return
+        self._pruned_at = now
+
+        cutoff = now - 2 * self.max_age
+        for path, (value, published) in self._last.items():
+            if published < cutoff:
+                del self._last[path]
@@ -0,0 +1,23 @@
+# coding=utf-8
+
+"""
+Turn arbitrary strings into single metric path components
+
+Hostnames, systemd unit names and the like contain dots, colons and other
+characters that would split or break a graphite path.
+
+    from metricname import metric_safe
+
+    metric_safe('10.0.0.1:8080')    # -> '10_0_0_1_8080'
+"""
+
+import re
+
+__all__ = ['metric_safe']
+
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def metric_safe(name):
+    """Replace every character other than letters, digits, _ and - with _."""
+    return _UNSAFE_RE.sub('_', name)
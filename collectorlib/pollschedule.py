@@ -0,0 +1,187 @@
+# coding=utf-8
+
+"""
+Deadlines, backoff and overlap protection for network-polling collectors
+
+PollScheduleMixin gives a collector three things:
+
+ * A deadline per collection (`timeout` seconds). request_timeout() returns
+   the time left, to be used as the socket timeout of each request, and
+   raises DeadlineExceeded once it has run out.
+ * Exponential backoff with jitter per endpoint. An endpoint that failed is
+   skipped until its backoff expires; only its first failure is logged with
+   a traceback, later ones as a single line.
+ * @scheduled skips a collection outright if the previous one is still
+   running, so a slow upstream cannot pile up threads in diamond.
+
+    from pollschedule import PollScheduleMixin, scheduled
+
+    class FooCollector(PollScheduleMixin, diamond.collector.Collector):
+
+        @scheduled
+        def collect(self):
+            if not self.endpoint_ready(url):
+                return
+            try:
+                data = urllib2.urlopen(url,
+                                       timeout=self.request_timeout()).read()
+            except (urllib2.URLError, socket.error):
+                self.endpoint_failed(url, "Error fetching %s", url)
+                return
+            self.endpoint_succeeded(url)
+"""
+
+import random
+import socket
+import threading
+import time
+from functools import wraps
+
+__all__ = ['Backoff', 'DeadlineExceeded', 'PollScheduleMixin', 'scheduled']
+
+
+class DeadlineExceeded(socket.timeout):
+    """The collection ran past its deadline.
+
+    A socket.timeout, so existing socket.error handlers treat it as a failed
+    request.
+
+    """
+
+
+class Backoff(object):
+    """Exponential backoff with jitter for a single endpoint.
+
+    After n consecutive failures the endpoint is retried after a delay drawn
+    uniformly from [d / 2, d] where d = min(base * 2 ** (n - 1), maximum).
+
+    """
+    def __init__(self, base, maximum):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.retry_at = 0
+
+    def ready(self, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self.retry_at
+
+    def failure(self, now=None):
+        """Record a failure and return the delay until the next attempt."""
+        if now is None:
+            now = time.time()
+        self.failures += 1
+        delay = min(self.base * 2 ** (self.failures - 1), self.maximum)
+        delay = random.uniform(delay / 2.0, delay)
+        self.retry_at = now + delay
+        return delay
+
+    def success(self):
+        self.failures = 0
+        self.retry_at = 0
+
+
+def scheduled(collect):
+    """Decorate collect() to enforce the deadline and skip overlapping
+    collections.
+
+    """
+    @wraps(collect)
+    def wrapper(self):
+        lock = self.__dict__.setdefault('_collect_lock', threading.Lock())
+        if not lock.acquire(False):
+            self.log.warning("%s: previous collection still running, "
+                             "skipping this interval",
+                             self.__class__.__name__)
+            return
+
+        try:
+            self._deadline = time.time() + float(self.config['timeout'])
+            return collect(self)
+        finally:
+            self._deadline = None
+            lock.release()
+    return wrapper
+
+
+class PollScheduleMixin(object):
+    """Per-collection deadline and per-endpoint backoff.
+
+    Must come before diamond.collector.Collector in the bases so its
+    get_default_config() is picked up.
+
+    """
+    def get_default_config_help(self):
+        config_help = super(PollScheduleMixin,
+                            self).get_default_config_help()
+        config_help.update({
+            'timeout': "Seconds a whole collection may take",
+            'backoff_base': "Seconds to back off after the first failure "
+                            "of an endpoint, doubled on each further "
+                            "failure (default: the interval)",
+            'backoff_max': "Maximum seconds to back off a failing endpoint",
+        })
+        return config_help
+
+    def get_default_config(self):
+        config = super(PollScheduleMixin, self).get_default_config()
+        config.update({
+            'timeout': 10,
+            'backoff_base': '',
+            'backoff_max': 600,
+        })
+        return config
+
+    def remaining(self):
+        """Seconds left before the deadline, possibly negative."""
+        deadline = getattr(self, '_deadline', None)
+        if deadline is None:
+            return float(self.config['timeout'])
+        return deadline - time.time()
+
+    def request_timeout(self):
+        """Timeout for the next request; raises DeadlineExceeded if the
+        collection is out of time.
+
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('collection deadline exceeded')
+        return remaining
+
+    def _backoff(self, endpoint):
+        backoffs = self.__dict__.setdefault('_backoffs', {})
+        if endpoint not in backoffs:
+            base = (self.config['backoff_base']
+                    or self.config['interval'])
+            backoffs[endpoint] = Backoff(float(base),
+                                         float(self.config['backoff_max']))
+        return backoffs[endpoint]
+
+    def endpoint_ready(self, endpoint):
+        """False while endpoint is backing off after a failure."""
+        return self._backoff(endpoint).ready()
+
+    def endpoint_failed(self, endpoint, msg, *args):
+        """Record a failure of endpoint and log msg.
+
+        Call from within the except block so the first failure is logged
+        with its traceback.
+
+        """
+        backoff = self._backoff(endpoint)
+        delay = backoff.failure()
+        if backoff.failures == 1:
+            self.log.error(msg, *args, exc_info=True)
+        else:
+            self.log.warning(msg + " (%d consecutive failures)",
+                             *(args + (backoff.failures,)))
+        self.log.info("Backing off %s for %.1fs", endpoint, delay)
+
+    def endpoint_succeeded(self, endpoint):
+        backoff = self._backoff(endpoint)
+        if backoff.failures:
+            self.log.info("%s recovered after %d failures",
+                          endpoint, backoff.failures)
+        backoff.success()
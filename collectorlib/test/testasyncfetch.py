@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+import SocketServer
+import socket
+import threading
+
+from test import unittest
+from mock import MagicMock
+
+from asyncfetch import (
+    HTTPFetch,
+    HTTPStatusError,
+    TCPFetch,
+    fetch_all,
+    zk_pipeline,
+)
+
+###############################################################################
+
+
+class EchoHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if line.startswith('GET /missing'):
+            self.wfile.write('HTTP/1.0 404 Not Found\r\n\r\nnope')
+        elif line.startswith('GET '):
+            self.wfile.write('HTTP/1.0 200 OK\r\n'
+                             'Content-Type: application/json\r\n\r\n{}')
+        else:
+            self.wfile.write('echo:' + line)
+
+
+class TestFetchAll(unittest.TestCase):
+    def setUp(self):
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      EchoHandler)
+        self.address = self.server.server_address
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent_fetches(self):
+        tcp, http, missing = fetch_all([
+            TCPFetch(self.address, 'sample\n', 5),
+            HTTPFetch(self.address[0], self.address[1], '/status', 5),
+            HTTPFetch(self.address[0], self.address[1], '/missing', 5),
+        ])
+
+        self.assertEqual(tcp.error, None)
+        self.assertEqual(tcp.result(), 'echo:sample\n')
+        self.assertEqual(http.result(), '{}')
+        self.assertRaises(HTTPStatusError, missing.result)
+
+    def test_connection_refused(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        address = listener.getsockname()
+        listener.close()
+
+        fetch, = fetch_all([TCPFetch(address, 'sample\n', 5)])
+        self.assertTrue(isinstance(fetch.error, socket.error))
+
+    def test_timeout(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            fetch, = fetch_all([TCPFetch(listener.getsockname(), 'x', 0.1)])
+        finally:
+            listener.close()
+
+        self.assertTrue(isinstance(fetch.error, socket.timeout))
+
+
+class TestZkPipeline(unittest.TestCase):
+    def test_sends_all_before_waiting(self):
+        zk = MagicMock()
+        order = []
+        zk.get_async.side_effect = lambda path: order.append(path) or \
+            MagicMock(get=lambda timeout: order.append('wait') or path)
+
+        self.assertEqual(zk_pipeline(zk, 'get', ['/a', '/b'], 5),
+                         ['/a', '/b'])
+        self.assertEqual(order, ['/a', '/b', 'wait', 'wait'])
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
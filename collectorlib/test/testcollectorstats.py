@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import patch
+
+from diamond.collector import Collector
+from collectorstats import CollectorStatsMixin, instrumented
+
+###############################################################################
+
+
+class StatsCollector(CollectorStatsMixin, Collector):
+    @instrumented
+    def collect(self):
+        with self.timed('fetch'):
+            pass
+        self.count_items('things', 3)
+        self.count_bytes('response', 100)
+        self.count_bytes('response', 24)
+
+
+class TestCollectorStatsMixin(CollectorTestCase):
+    def setUp(self):
+        config = get_collector_config('StatsCollector', {
+            'interval': 10,
+            'path': 'stats',
+        })
+
+        self.collector = StatsCollector(config, None)
+
+    def published(self, publish_metric):
+        root = self.collector.get_metric_path('')
+        return dict((call[0][0].path[len(root):], call[0][0].value)
+                    for call in publish_metric.call_args_list)
+
+    def test_default_config(self):
+        self.assertTrue(self.collector.config['collector_stats'])
+
+    @patch.object(Collector, 'publish_metric')
+    def test_collect(self, publish_metric):
+        self.collector.collect()
+
+        metrics = self.published(publish_metric)
+        self.assertEqual(sorted(metrics), [
+            'collector.bytes.response',
+            'collector.items.things',
+            'collector.time.fetch',
+            'collector.time.total',
+        ])
+        self.assertEqual(metrics['collector.items.things'], 3)
+        self.assertEqual(metrics['collector.bytes.response'], 124)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_stats_reset_between_collections(self, publish_metric):
+        self.collector.collect()
+        publish_metric.reset_mock()
+        self.collector.collect()
+
+        self.assertEqual(
+            self.published(publish_metric)['collector.bytes.response'], 124)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_reset_keeps_lock_and_dict(self, publish_metric):
+        self.collector.collect()
+        lock, stats = self.collector._stats_lock, self.collector._stats
+        self.collector.collect()
+
+        # Threads left over from the first collection must still write into
+        # the stats the second one publishes
+        self.assertTrue(self.collector._stats_lock is lock)
+        self.assertTrue(self.collector._stats is stats)
+        self.assertEqual(stats['bytes.response'], 124)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_disabled(self, publish_metric):
+        self.collector.config['collector_stats'] = 'False'
+        self.collector.collect()
+
+        self.assertFalse(publish_metric.called)
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+import re
+
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import patch
+
+from diamond.collector import Collector
+from metricbatch import MetricBatch
+
+###############################################################################
+
+
+class BatchCollector(Collector):
+    def collect(self):
+        pass
+
+
+class TestMetricBatch(CollectorTestCase):
+    def setUp(self):
+        config = get_collector_config('BatchCollector', {
+            'interval': 10,
+            'path': 'batch',
+        })
+
+        self.collector = BatchCollector(config, None)
+        self.batch = MetricBatch.for_collector(self.collector)
+
+    def test_for_collector_reuses_batch(self):
+        self.assertTrue(MetricBatch.for_collector(self.collector) is self.batch)
+
+    def test_path_is_cached(self):
+        path = self.batch.path('foo.bar')
+        self.assertEqual(path, self.collector.get_metric_path('foo.bar'))
+
+        with patch.object(self.collector, 'get_metric_path') as get_path:
+            self.assertTrue(self.batch.path('foo.bar') is path)
+            self.assertFalse(get_path.called)
+
+    def test_path_unicode_name(self):
+        self.assertEqual(self.batch.path(u'foo.bar'),
+                         self.collector.get_metric_path(u'foo.bar'))
+
+    @patch.object(Collector, 'publish_metric')
+    def test_flush(self, publish_metric):
+        self.batch.add('foo', 1)
+        self.batch.add('bar', 2.5, precision=1)
+
+        self.assertEqual(self.batch.flush(), 2)
+        self.assertEqual(len(self.batch), 0)
+
+        metrics = [call[0][0] for call in publish_metric.call_args_list]
+        self.assertEqual(
+            [(m.path, m.value) for m in metrics],
+            [(self.collector.get_metric_path('foo'), 1),
+             (self.collector.get_metric_path('bar'), 2.5)])
+        self.assertEqual(metrics[0].timestamp, metrics[1].timestamp)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_flush_skips_blacklisted(self, publish_metric):
+        self.collector.config['metrics_blacklist'] = re.compile('^bar')
+
+        self.batch.add('foo', 1)
+        self.batch.add('bar', 2)
+
+        self.assertEqual(self.batch.flush(), 1)
+        self.assertEqual(publish_metric.call_args_list[0][0][0].path,
+                         self.collector.get_metric_path('foo'))
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import patch
+
+from diamond.collector import Collector
+from metricbatch import MetricBatch
+from metricdedup import MetricDedup
+
+###############################################################################
+
+
+class DedupCollector(Collector):
+    def collect(self):
+        pass
+
+
+class TestMetricDedup(unittest.TestCase):
+    def setUp(self):
+        self.dedup = MetricDedup(heartbeat=3, interval=10)
+
+    def test_suppresses_unchanged(self):
+        self.assertTrue(self.dedup.should_publish('a', 1, now=0))
+        self.assertFalse(self.dedup.should_publish('a', 1, now=10))
+        self.assertTrue(self.dedup.should_publish('a', 2, now=20))
+        self.assertTrue(self.dedup.should_publish('b', 2, now=20))
+        self.assertEqual(self.dedup.suppressed, 1)
+
+    def test_heartbeat(self):
+        published = [now for now in xrange(0, 100, 10)
+                     if self.dedup.should_publish('a', 1, now)]
+        self.assertEqual(published, [0, 30, 60, 90])
+
+    def test_heartbeat_tolerates_early_collection(self):
+        self.dedup.should_publish('a', 1, now=0)
+        self.assertTrue(self.dedup.should_publish('a', 1, now=28))
+
+    def test_prune(self):
+        self.dedup.should_publish('gone', 1, now=0)
+        self.dedup.should_publish('kept', 1, now=40)
+
+        self.dedup.prune(now=60)
+        self.assertEqual(len(self.dedup), 1)
+        self.assertFalse(self.dedup.should_publish('kept', 1, now=60))
+
+
+class TestMetricBatchDedup(CollectorTestCase):
+    def get_batch(self, heartbeat):
+        config = get_collector_config('DedupCollector', {
+            'interval': 10,
+            'dedup_heartbeat': heartbeat,
+        })
+        return MetricBatch.for_collector(DedupCollector(config, None))
+
+    @patch.object(Collector, 'publish_metric')
+    def test_disabled_by_default(self, publish_metric):
+        batch = self.get_batch(0)
+        self.assertEqual(batch.dedup, None)
+
+        for _ in xrange(2):
+            batch.add('foo', 1)
+            self.assertEqual(batch.flush(), 1)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_flush_suppresses_unchanged(self, publish_metric):
+        batch = self.get_batch(5)
+
+        batch.add('foo', 1)
+        batch.add('bar', 1)
+        self.assertEqual(batch.flush(), 2)
+
+        batch.add('foo', 1)
+        batch.add('bar', 2)
+        self.assertEqual(batch.flush(), 1)
+        self.assertEqual(publish_metric.call_args[0][0].path,
+                         batch.path('bar'))
+        self.assertEqual(len(batch), 0)
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+from test import unittest
+
+from metricname import metric_safe
+
+###############################################################################
+
+
+class TestMetricSafe(unittest.TestCase):
+    def test_metric_safe(self):
+        self.assertEqual(metric_safe('10.0.0.1:8080'), '10_0_0_1_8080')
+        self.assertEqual(metric_safe('user@1000'), 'user_1000')
+        self.assertEqual(metric_safe('docker-4f1c_x'), 'docker-4f1c_x')
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+import time
+
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+
+from diamond.collector import Collector
+from pollschedule import (
+    Backoff,
+    DeadlineExceeded,
+    PollScheduleMixin,
+    scheduled,
+)
+
+###############################################################################
+
+
+class PollCollector(PollScheduleMixin, Collector):
+    @scheduled
+    def collect(self):
+        self.calls += 1
+        return self.request_timeout()
+
+
+class TestBackoff(unittest.TestCase):
+    def test_delay_doubles_and_caps(self):
+        backoff = Backoff(10, 60)
+        delays = [backoff.failure(now=0) for _ in xrange(5)]
+
+        for delay, ceiling in zip(delays, [10, 20, 40, 60, 60]):
+            self.assertTrue(ceiling / 2.0 <= delay <= ceiling)
+
+    def test_ready(self):
+        backoff = Backoff(10, 60)
+        delay = backoff.failure(now=100)
+
+        self.assertFalse(backoff.ready(now=100))
+        self.assertTrue(backoff.ready(now=100 + delay))
+
+        backoff.success()
+        self.assertEqual(backoff.failures, 0)
+        self.assertTrue(backoff.ready(now=100))
+
+
+class TestPollScheduleMixin(CollectorTestCase):
+    def setUp(self):
+        config = get_collector_config('PollCollector', {
+            'interval': 10,
+            'timeout': 5,
+        })
+
+        self.collector = PollCollector(config, None)
+        self.collector.calls = 0
+
+    def test_request_timeout_within_deadline(self):
+        timeout = self.collector.collect()
+        self.assertTrue(0 < timeout <= 5)
+
+    def test_request_timeout_past_deadline(self):
+        self.collector._deadline = time.time() - 1
+        self.assertRaises(DeadlineExceeded, self.collector.request_timeout)
+
+    def test_skips_overlapping_collection(self):
+        self.collector.collect()
+        self.assertEqual(self.collector.calls, 1)
+
+        self.collector._collect_lock.acquire()
+        try:
+            self.assertEqual(self.collector.collect(), None)
+            self.assertEqual(self.collector.calls, 1)
+        finally:
+            self.collector._collect_lock.release()
+
+    def test_endpoint_backoff(self):
+        self.assertTrue(self.collector.endpoint_ready('host:80'))
+
+        try:
+            raise IOError('down')
+        except IOError:
+            self.collector.endpoint_failed('host:80', "host:80 is %s", 'down')
+
+        self.assertFalse(self.collector.endpoint_ready('host:80'))
+        self.assertTrue(self.collector.endpoint_ready('other:80'))
+
+        self.collector.endpoint_succeeded('host:80')
+        self.assertTrue(self.collector.endpoint_ready('host:80'))
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
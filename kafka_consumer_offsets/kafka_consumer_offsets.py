@@ -1,24 +1,37 @@
 # coding=utf-8
 
-import sys
+import re
+from functools import partial
 
 import diamond.collector
+from diamond.collector import str_to_bool
 try:
     from kazoo.client import KazooClient
 except ImportError:
     KazooClient = None
 
+from asyncfetch import zk_pipeline
+from collectorstats import CollectorStatsMixin, instrumented
+from metricbatch import MetricBatch
+from pollschedule import PollScheduleMixin, scheduled
+
+
+class KafkaConsumerOffsetsCollector(CollectorStatsMixin, PollScheduleMixin,
+                                    diamond.collector.Collector):
+    _zk = None
 
-class KafkaConsumerOffsetsCollector(diamond.collector.Collector):
     def get_default_config(self):
         """
         Returns the default collector settings
         """
-        config = super(NginxPushStreamCollector, self).get_default_config()
+        config = super(KafkaConsumerOffsetsCollector,
+                       self).get_default_config()
         config.update({
             'zk_host': '127.0.0.1:2181/kafka',
             'group_regex': '',
-            'consumer_regex': ''
+            'consumer_regex': '',
+            'async_fetch': False,
+            'dedup_heartbeat': 0,
         })
         return config
 
@@ -28,10 +41,36 @@ class KafkaConsumerOffsetsCollector(diamond.collector.Collector):
             self._zk = KazooClient(self.config['zk_host'])
         return self._zk
 
+    @scheduled
+    @instrumented
     def collect(self):
-        self.zk.start()
+        zk_host = self.config['zk_host']
+        if not self.endpoint_ready(zk_host):
+            return
+
+        try:
+            self.zk.start(timeout=self.request_timeout())
+            self.collect_offsets()
+        except Exception:
+            self.endpoint_failed(zk_host,
+                                 "Error collecting consumer offsets from %s",
+                                 zk_host)
+        else:
+            self.endpoint_succeeded(zk_host)
+        finally:
+            self.zk.stop()
+
+    def zk_read(self, method, path):
+        """Call zk.<method>(path), waiting no longer than the time left in
+        the collection; raises DeadlineExceeded once it has run out.
 
-        consumer_group_names = self.zk.get_children('/consumers')
+        """
+        timeout = self.request_timeout()
+        return getattr(self.zk, method + '_async')(path).get(timeout=timeout)
+
+    def collect_offsets(self):
+        batch = MetricBatch.for_collector(self)
+        consumer_group_names = self.zk_read('get_children', '/consumers')
         for group in consumer_group_names:
 
             if not re.search(self.config['group_regex'], group):
@@ -41,11 +80,11 @@ class KafkaConsumerOffsetsCollector(diamond.collector.Collector):
                     self.config['group_regex']
                 )
                 continue
-            ids = self.zk.get_children('/consumers/%s/ids' % group)
-            if not all(
+            ids = self.zk_read('get_children', '/consumers/%s/ids' % group)
+            if not all(map(
                 partial(re.search, self.config['consumer_regex']),
                 ids
-            ):
+            )):
                 self.log.warn(
                     "Skipping '%s' because not all consumers match /%s/",
                     group,
@@ -53,7 +92,8 @@ class KafkaConsumerOffsetsCollector(diamond.collector.Collector):
                 )
                 continue
 
-            topic_names = self.zk_get_children(
+            topic_names = self.zk_read(
+                'get_children',
                 '/consumers/%s/offsets' % group
             )
             for topic in topic_names:
@@ -62,19 +102,28 @@ class KafkaConsumerOffsetsCollector(diamond.collector.Collector):
                     group,
                     topic
                 )
-                partition_ids = self.zk.get_children(
+                partition_ids = self.zk_read(
+                    'get_children',
                     '/consumers/%s/offsets/%s' % (group, topic)
                 )
-                for partition in partition_ids:
-                    offset = self.zk.get(
-                        '/consumers/%s/offsets/%s/%s'
-                        % (group, topic, partition)
-                    )
-                    self.publish('%s.%s.%s' % (
+                self.count_items('partitions', len(partition_ids))
+                paths = [
+                    '/consumers/%s/offsets/%s/%s' % (group, topic, partition)
+                    for partition in partition_ids
+                ]
+                if str_to_bool(self.config['async_fetch']):
+                    offsets = zk_pipeline(self.zk, 'get', paths,
+                                          self.request_timeout())
+                else:
+                    offsets = [self.zk_read('get', path) for path in paths]
+
+                for partition, (offset, _) in zip(partition_ids, offsets):
+                    batch.add('%s.%s.%s' % (
                         group,
                         topic,
                         partition
                     ), offset)
 
-        self.zk.stop()
+        with self.timed('publish'):
+            batch.flush()
 
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+import time
+
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import MagicMock, patch
+
+from diamond.collector import Collector
+from kafka_consumer_offsets import KafkaConsumerOffsetsCollector
+from pollschedule import DeadlineExceeded
+
+###############################################################################
+
+
+class AsyncResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+
+def make_zk(nodes):
+    zk = MagicMock()
+    zk.get_children_async.side_effect = lambda path: AsyncResult(
+        nodes[path])
+    zk.get_async.side_effect = lambda path: AsyncResult((nodes[path], None))
+    return zk
+
+
+class TestKafkaConsumerOffsetsCollector(CollectorTestCase):
+    def setUp(self):
+        config = get_collector_config('KafkaConsumerOffsetsCollector', {
+            'interval': 10,
+            'timeout': 5,
+        })
+        self.collector = KafkaConsumerOffsetsCollector(config, None)
+        self.collector._zk = make_zk({
+            '/consumers': ['group'],
+            '/consumers/group/ids': ['consumer'],
+            '/consumers/group/offsets': ['topic'],
+            '/consumers/group/offsets/topic': ['0', '1'],
+            '/consumers/group/offsets/topic/0': '100',
+            '/consumers/group/offsets/topic/1': '200',
+        })
+
+    @patch.object(Collector, 'publish_metric')
+    def test_collect(self, publish_metric):
+        self.collector.collect()
+
+        prefix = self.collector.get_metric_path('')
+        metrics = dict((call[0][0].path[len(prefix):], call[0][0].value)
+                       for call in publish_metric.call_args_list)
+        self.assertDictContainsSubset({'group.topic.0': 100,
+                                       'group.topic.1': 200}, metrics)
+
+    def test_zk_read_bounded_by_deadline(self):
+        zk = self.collector._zk = MagicMock()
+        self.collector._deadline = time.time() + 5
+
+        self.collector.zk_read('get', '/a')
+        timeout = zk.get_async.return_value.get.call_args[1]['timeout']
+        self.assertTrue(0 < timeout <= 5)
+
+    def test_zk_read_past_deadline(self):
+        zk = self.collector._zk = MagicMock()
+        self.collector._deadline = time.time() - 1
+
+        self.assertRaises(DeadlineExceeded, self.collector.zk_read,
+                          'get_children', '/consumers')
+        self.assertFalse(zk.get_children_async.called)
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
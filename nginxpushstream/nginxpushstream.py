@@ -3,6 +3,20 @@
 """
 Collect the stats from the nginx-push-stream module
 
+Either a single status page given by host, port and location, or several
+nginx instances listed in `endpoints` and fetched concurrently:
+
+```
+endpoints = 10.0.0.1:8080/push-stream-status, 10.0.0.1:8081, 10.0.0.2:8080
+```
+
+An endpoint without a location uses `location`. With `endpoints` set,
+each instance's values are published under `instances.<host>_<port>`, the
+sums across instances at the top level (the smallest `uptime`), and the
+largest values under `max`. An instance that fails keeps contributing its
+last good response to the aggregates for up to `cache_max_age` seconds;
+`instances_up` and `instances_stale` count fresh and cached instances.
+
 #### Dependencies
 
  * urlib2
@@ -11,7 +25,11 @@ Collect the stats from the nginx-push-stream module
 """
 
 import socket
+import threading
+import time
 import urllib2
+from collections import namedtuple
+from functools import partial
 
 try:
     import json
@@ -20,13 +38,37 @@ except ImportError:
     import simplejson as json
 
 import diamond.collector
+from diamond.collector import str_to_bool
+
+from asyncfetch import FetchError, HTTPFetch, HTTPStatusError, fetch_all
+from collectorstats import CollectorStatsMixin, instrumented
+from metricbatch import MetricBatch
+from metricname import metric_safe
+from pollschedule import PollScheduleMixin, scheduled
+
+
+class Endpoint(namedtuple('Endpoint', ['name', 'host', 'port', 'location'])):
+    """A status page; name is None for the single host/port endpoint."""
 
+    @property
+    def url(self):
+        return 'http://%s:%s%s' % (self.host, self.port, self.location)
 
-class NginxPushStreamCollector(diamond.collector.Collector):
+
+class NginxPushStreamCollector(CollectorStatsMixin, PollScheduleMixin,
+                               diamond.collector.Collector):
     METRIC_KEYS = frozenset(['channels', 'broadcast_channels',
                             'published_messages', 'stored_messages',
                             'messages_in_trash', 'channels_in_trash',
                             'subscribers', 'uptime'])
+    # Aggregated across instances with min() rather than summed
+    MIN_KEYS = frozenset(['uptime'])
+
+    def __init__(self, *args, **kwargs):
+        super(NginxPushStreamCollector, self).__init__(*args, **kwargs)
+
+        # instance name -> (time fetched, parsed response)
+        self._last_good = {}
 
     def get_default_config_help(self):
         config_help = super(NginxPushStreamCollector,
@@ -35,6 +77,12 @@ class NginxPushStreamCollector(diamond.collector.Collector):
             'host': '',
             'port': '',
             'location': "Location with push_stream_channel_statistics enabled",
+            'async_fetch': "Fetch through the asyncore event loop instead "
+                           "of urllib2",
+            'endpoints': "host:port[/location] status pages to fetch and "
+                         "aggregate instead of host, port and location",
+            'cache_max_age': "Seconds a failed instance's last good "
+                             "response still counts in the aggregates",
         })
         return config_help
 
@@ -49,47 +97,223 @@ class NginxPushStreamCollector(diamond.collector.Collector):
             'location': '/push-stream-status',
             'path':     'nginxpushstream',
             'method':   'Threaded',
+            'async_fetch': False,
+            'endpoints': '',
+            'cache_max_age': 300,
         })
         return config
 
-    def get_json(self):
-        url = ''.join(['http://',
-                       self.config['host'],
-                       ':',
-                       str(self.config['port']),
-                       self.config['location']])
+    def get_endpoints(self):
+        """Return the configured Endpoints."""
+        endpoints = self.config['endpoints']
+        if isinstance(endpoints, basestring):
+            endpoints = endpoints.split(',')
+        endpoints = [endpoint.strip() for endpoint in endpoints
+                     if endpoint.strip()]
+
+        if not endpoints:
+            return [Endpoint(None, self.config['host'],
+                             int(self.config['port']),
+                             self.config['location'])]
+
+        parsed = []
+        for endpoint in endpoints:
+            if endpoint.startswith('http://'):
+                endpoint = endpoint[len('http://'):]
+            address, slash, location = endpoint.partition('/')
+            host, _, port = address.partition(':')
+            port = int(port or 80)
+            name = metric_safe('%s_%s' % (host, port))
+            parsed.append(Endpoint(name, host, port,
+                                   slash + location if slash
+                                   else self.config['location']))
+        return parsed
 
+    def get_json(self, url, fetch):
+        """Return the response body from fetch(), or None after logging and
+        backing off url if it failed.
+
+        Success is only recorded once get_data() has parsed the body.
+
+        """
         try:
-            response = urllib2.urlopen(url).read()
+            response = fetch()
         except urllib2.HTTPError, err:
-            self.log.error("%s %s: %s", url, err.code, err.read())
-            return ''
+            self.endpoint_failed(url, "%s %s: %s", url, err.code, err.read())
+            return None
+        except HTTPStatusError, err:
+            self.endpoint_failed(url, "%s %s: %s", url, err.code, err.body)
+            return None
+        except FetchError, err:
+            self.endpoint_failed(url, "%s: %s", url, err)
+            return None
         except urllib2.URLError, err:
-            self.log.error("%s: %s", url, err.reason)
-            return ''
+            self.endpoint_failed(url, "%s: %s", url, err.reason)
+            return None
         except socket.error, err:
-            self.log.error("%s %s: %s", url, err.errno, err.message)
-            return ''
+            self.endpoint_failed(url, "%s %s: %s", url, err.errno, err)
+            return None
 
         return response
 
-    def get_data(self):
-        json_string = self.get_json()
+    def urlopen(self, url):
+        return urllib2.urlopen(url, timeout=self.request_timeout()).read()
+
+    @staticmethod
+    def fetch_result(fetch):
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.result()
+
+    def fetch_endpoints(self, endpoints):
+        """Fetch every endpoint that is not backing off, concurrently.
+
+        Returns a list of (endpoint, response body), None for failures.
+
+        """
+        ready = [endpoint for endpoint in endpoints
+                 if self.endpoint_ready(endpoint.url)]
+        if not ready:
+            return []
+
+        if str_to_bool(self.config['async_fetch']):
+            fetches = fetch_all([
+                HTTPFetch(endpoint.host, endpoint.port, endpoint.location,
+                          self.request_timeout())
+                for endpoint in ready])
+            return [(endpoint,
+                     self.get_json(endpoint.url,
+                                   partial(self.fetch_result, fetch)))
+                    for endpoint, fetch in zip(ready, fetches)]
+
+        responses = {}
+
+        def fetch(endpoint):
+            responses[endpoint] = self.get_json(
+                endpoint.url, partial(self.urlopen, endpoint.url))
+
+        if len(ready) == 1:
+            fetch(ready[0])
+        else:
+            threads = [threading.Thread(target=fetch, args=(endpoint,))
+                       for endpoint in ready]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join(max(self.remaining(), 0))
+
+        return [(endpoint, responses[endpoint]) for endpoint in ready
+                if endpoint in responses]
+
+    def get_data(self, endpoint, json_string):
+        """Parse a response body from get_json(), recording the endpoint as
+        failed if it is not valid JSON.
+
+        """
+        if json_string is None:
+            return None
+        self.count_bytes('response', len(json_string))
 
         try:
-            data = json.loads(json_string)
+            with self.timed('parse'):
+                data = json.loads(json_string)
         except (TypeError, ValueError):
-            self.log.exception("Unable to parse response from push-stream")
+            self.endpoint_failed(endpoint.url,
+                                 "Unable to parse response from %s",
+                                 endpoint.url)
             return None
 
+        self.endpoint_succeeded(endpoint.url)
         return data
 
+    def get_instances(self, endpoints, responses):
+        """Return ({name: data} of the instances that answered, {name: data}
+        of the others still within cache_max_age of their last good
+        response).
+
+        """
+        now = time.time()
+        max_age = float(self.config['cache_max_age'])
+        fresh = {}
+        cached = {}
+
+        for endpoint, response in responses:
+            data = self.get_data(endpoint, response)
+            if data:
+                fresh[endpoint.name] = data
+                self._last_good[endpoint.name] = (now, data)
+
+        for endpoint in endpoints:
+            if endpoint.name in fresh:
+                continue
+            fetched, data = self._last_good.get(endpoint.name, (None, None))
+            if fetched is None:
+                continue
+            if now - fetched > max_age:
+                del self._last_good[endpoint.name]
+            else:
+                cached[endpoint.name] = data
+
+        return fresh, cached
+
+    def aggregate(self, instances):
+        """Return ({key: total}, {key: max}) across instance data."""
+        totals = {}
+        maxima = {}
+        for data in instances.itervalues():
+            for key, stat in data.iteritems():
+                if key not in self.METRIC_KEYS:
+                    continue
+                if key not in totals:
+                    totals[key] = maxima[key] = stat
+                    continue
+                if key in self.MIN_KEYS:
+                    totals[key] = min(totals[key], stat)
+                else:
+                    totals[key] += stat
+                maxima[key] = max(maxima[key], stat)
+        return totals, maxima
+
+    @scheduled
+    @instrumented
     def collect(self):
-        data = self.get_data()
+        endpoints = self.get_endpoints()
+        with self.timed('fetch'):
+            responses = self.fetch_endpoints(endpoints)
+
+        if endpoints[0].name is None:
+            data = self.get_data(*responses[0]) if responses else None
+            if not data:
+                return
 
-        if not data:
+            with self.timed('publish'):
+                batch = MetricBatch.for_collector(self)
+                for key, stat in data.iteritems():
+                    if key in self.METRIC_KEYS:
+                        batch.add(key, stat)
+                batch.flush()
             return
 
-        for key, stat in data.iteritems():
-            if key in self.METRIC_KEYS:
-                self.publish(key, stat)
+        fresh, cached = self.get_instances(endpoints, responses)
+        self.count_items('instances', len(fresh))
+        if not fresh and not cached:
+            return
+
+        instances = dict(cached)
+        instances.update(fresh)
+        totals, maxima = self.aggregate(instances)
+
+        with self.timed('publish'):
+            batch = MetricBatch.for_collector(self)
+            for name, data in fresh.iteritems():
+                for key, stat in data.iteritems():
+                    if key in self.METRIC_KEYS:
+                        batch.add('instances.%s.%s' % (name, key), stat)
+            for key, stat in totals.iteritems():
+                batch.add(key, stat)
+            for key, stat in maxima.iteritems():
+                batch.add('max.' + key, stat)
+            batch.add('instances_up', len(fresh))
+            batch.add('instances_stale', len(cached))
+            batch.flush()
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+import json
+import socket
+import time
+from StringIO import StringIO
+
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import patch
+
+from diamond.collector import Collector
+from nginxpushstream import Endpoint, NginxPushStreamCollector
+
+###############################################################################
+
+
+def status(subscribers, channels, uptime):
+    return json.dumps({'hostname': 'push', 'subscribers': subscribers,
+                       'channels': channels, 'uptime': uptime,
+                       'by_worker': []})
+
+
+def published(collector, publish_metric):
+    prefix = collector.get_metric_path('')
+    return dict((call[0][0].path[len(prefix):], call[0][0].value)
+                for call in publish_metric.call_args_list)
+
+
+class TestNginxPushStreamCollector(CollectorTestCase):
+    def setUp(self):
+        config = get_collector_config('NginxPushStreamCollector', {
+            'interval': 10,
+            'endpoints': ['10.0.0.1:8080/status', '10.0.0.1:8081',
+                          'http://10.0.0.2'],
+        })
+        self.collector = NginxPushStreamCollector(config, None)
+        self.responses = {
+            'http://10.0.0.1:8080/status': status(10, 2, 100),
+            'http://10.0.0.1:8081/push-stream-status': status(30, 5, 50),
+            'http://10.0.0.2:80/push-stream-status': status(5, 1, 200),
+        }
+
+    def urlopen(self, url, timeout):
+        response = self.responses[url]
+        if response is None:
+            raise socket.error(111, 'Connection refused')
+        return StringIO(response)
+
+    def test_get_endpoints(self):
+        self.assertEqual(self.collector.get_endpoints(), [
+            Endpoint('10_0_0_1_8080', '10.0.0.1', 8080, '/status'),
+            Endpoint('10_0_0_1_8081', '10.0.0.1', 8081,
+                     '/push-stream-status'),
+            Endpoint('10_0_0_2_80', '10.0.0.2', 80, '/push-stream-status'),
+        ])
+
+    def test_single_endpoint(self):
+        config = get_collector_config('NginxPushStreamCollector', {})
+        collector = NginxPushStreamCollector(config, None)
+        self.assertEqual(collector.get_endpoints(), [
+            Endpoint(None, '127.0.0.1', 80, '/push-stream-status')])
+
+    @patch.object(Collector, 'publish_metric')
+    def test_collect_aggregates(self, publish_metric):
+        with patch('urllib2.urlopen', self.urlopen):
+            self.collector.collect()
+
+        self.assertDictContainsSubset({
+            'instances.10_0_0_1_8081.subscribers': 30,
+            'subscribers': 45,
+            'channels': 8,
+            'uptime': 50,
+            'max.subscribers': 30,
+            'max.uptime': 200,
+            'instances_up': 3,
+            'instances_stale': 0,
+        }, published(self.collector, publish_metric))
+
+    @patch.object(Collector, 'publish_metric')
+    def test_failed_instance_uses_last_good_response(self, publish_metric):
+        with patch('urllib2.urlopen', self.urlopen):
+            self.collector.collect()
+            publish_metric.reset_mock()
+
+            self.responses['http://10.0.0.2:80/push-stream-status'] = None
+            self.collector.collect()
+
+        metrics = published(self.collector, publish_metric)
+        self.assertDictContainsSubset({
+            'subscribers': 45,
+            'instances_up': 2,
+            'instances_stale': 1,
+        }, metrics)
+        self.assertFalse('instances.10_0_0_2_80.subscribers' in metrics)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_invalid_json_backs_off(self, publish_metric):
+        url = 'http://10.0.0.2:80/push-stream-status'
+        self.responses[url] = '<html>502 Bad Gateway</html>'
+        with patch('urllib2.urlopen', self.urlopen):
+            self.collector.collect()
+
+        self.assertFalse(self.collector.endpoint_ready(url))
+        self.assertTrue(self.collector.endpoint_ready(
+            'http://10.0.0.1:8081/push-stream-status'))
+        self.assertDictContainsSubset({
+            'instances_up': 2,
+        }, published(self.collector, publish_metric))
+
+    @patch.object(Collector, 'publish_metric')
+    def test_expired_cache_is_dropped(self, publish_metric):
+        with patch('urllib2.urlopen', self.urlopen):
+            self.collector.collect()
+            publish_metric.reset_mock()
+
+            for name, (fetched, data) in self.collector._last_good.items():
+                self.collector._last_good[name] = (time.time() - 301, data)
+            self.responses['http://10.0.0.2:80/push-stream-status'] = None
+            self.collector.collect()
+
+        self.assertDictContainsSubset({
+            'subscribers': 40,
+            'instances_up': 2,
+            'instances_stale': 0,
+        }, published(self.collector, publish_metric))
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
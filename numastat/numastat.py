@@ -3,8 +3,11 @@
 import os
 import diamond.collector
 
+from collectorstats import CollectorStatsMixin, instrumented
+from metricbatch import MetricBatch
 
-class NumastatCollector(diamond.collector.Collector):
+
+class NumastatCollector(CollectorStatsMixin, diamond.collector.Collector):
 
     NODE = '/sys/devices/system/node'
 
@@ -12,6 +15,8 @@ class NumastatCollector(diamond.collector.Collector):
         config_help = super(NumastatCollector,
                             self).get_default_config_help()
         config_help.update({
+            'dedup_heartbeat': "Re-publish unchanged values only every this "
+                               "many intervals (0 publishes every value)",
         })
         return config_help
 
@@ -21,7 +26,8 @@ class NumastatCollector(diamond.collector.Collector):
         """
         config = super(NumastatCollector, self).get_default_config()
         config.update({
-            'path': 'numastat'
+            'path': 'numastat',
+            'dedup_heartbeat': 0,
         })
         return config
 
@@ -42,17 +48,25 @@ class NumastatCollector(diamond.collector.Collector):
 
         return paths
 
+    @instrumented
     def collect(self):
 
         if not os.access(self.NODE, os.R_OK):
             self.log.error('Unable to read: ' + self.NODE)
             return None
 
-        data = {}
-        for path in self.find_paths(self.NODE):
-            node = path.split(os.path.sep)[5]
+        with self.timed('discovery'):
+            paths = self.find_paths(self.NODE)
+        self.count_items('nodes', len(paths))
+
+        batch = MetricBatch.for_collector(self)
+        with self.timed('fetch'):
+            for path in paths:
+                prefix = os.path.basename(os.path.dirname(path)) + '.'
 
-            for k, v in self.get_data(path).items():
-                self.publish(node + '.' + k, long(v))
+                for k, v in self.get_data(path).iteritems():
+                    batch.add(prefix + k, long(v))
 
+        with self.timed('publish'):
+            batch.flush()
         return True
@@ -24,22 +24,66 @@ exe
 
 cmdline
 - Performs an re.search against the proc's cmdline
+
+Services can also be discovered instead of configured. With `discover`
+enabled every pid is grouped by the systemd unit or container its cgroup
+belongs to, and the busiest `discover_top` services are published under
+`services.<name>`, with the rest summed into `services.other`:
+
+```
+enabled=True
+discover=True
+discover_top=20
+```
+
+haproxy.service is published as services.haproxy and a container scope
+such as docker-<id>.scope as services.container_<first 12 hex digits of id>.
+Pids outside any service or container (kernel threads, login sessions) are
+not counted. The cgroup of a pid is only read once per (pid, starttime).
+
+Short bursts average out over a long collection interval. Setting
+`sample_interval` starts a background thread that samples the pids matched
+by the `[process]` filters every that many seconds, and each collection
+also publishes the max, 95th percentile and mean of those samples as
+`sampled.<name>.max`, `sampled.<name>.p95` and `sampled.<name>.mean`:
+
+```
+interval=60
+sample_interval=1
+```
+
+Matching still happens once per collection; the sampler only re-reads the
+stat files of the pids found then. Each group keeps its newest
+`sample_buffer` samples between collections.
 """
 
+import math
 import os
 import re
+import threading
+import time
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from fnmatch import fnmatch
+from operator import itemgetter
 from time import sleep
 
 import diamond.collector
+from diamond.collector import str_to_bool
+
+from collectorstats import CollectorStatsMixin, instrumented
+from metricbatch import MetricBatch
+from metricname import metric_safe
 
 __all__ = ['ProcessCpuCollector']
 
 _CLOCK_RATE = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
 _NUM_CPUS = os.sysconf('SC_NPROCESSORS_ONLN')
 
+_CONTAINER_RE = re.compile(
+    r'^(?:(?:docker|libpod|crio|cri-containerd)-([0-9a-f]{12,})\.scope'
+    r'|([0-9a-f]{64}))$')
+
 
 class Filter(object):
     """Base Filter
@@ -87,7 +131,7 @@ class PIDFileFilter(Filter):
                 and os.access(filter_string, os.R_OK))
 
     def _filter(self, on):
-        return on.split(os.sep)[2] in self.pids
+        return os.path.basename(on) in self.pids
 
     @property
     def pids(self):
@@ -160,36 +204,219 @@ class CMDLineFilter(Filter):
             return True
 
     def _filter(self, on):
-        with open(os.path.join(on, 'cmdline')) as fp:
-            cmdline = fp.read().strip()
+        cmdline = read_proc_file(os.path.join(on, 'cmdline')).strip()
 
         # convert to traditional space separated line
-        cmdline = ' '.join(cmdline.split('\x00'))
+        cmdline = cmdline.replace('\x00', ' ')
         return self.filter_re.search(cmdline) is not None
 
 
-def get_proc_cputime(pid):
-    """Sum proc user jiffies and system jiffies and return total time."""
-    with open('/proc/%s/stat' % pid) as proc_stat:
-        stat = proc_stat.read().strip()
+def read_proc_file(path, size=4096, head=False):
+    """Return the contents of a /proc file, or with head only its first
+    size bytes.
+
+    Reads with os.read() rather than a file object, which costs an extra
+    fstat() and a buffer allocation per open. Files smaller than size, such
+    as <pid>/stat, take a single read() call.
+
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunk = os.read(fd, size)
+        if head or len(chunk) < size:
+            return chunk
+
+        chunks = [chunk]
+        while chunk:
+            chunk = os.read(fd, size)
+            chunks.append(chunk)
+        return ''.join(chunks)
+    finally:
+        os.close(fd)
+
+
+def get_proc_times(pid, proc='/proc'):
+    """Return (total cputime, starttime in jiffies) of pid."""
+    stat = read_proc_file('%s/%s/stat' % (proc, pid))
 
-    stats = stat[stat.find(')') + 2:].split()
+    # comm may contain spaces and parentheses, so count fields from the last
+    # ')' and split no further than starttime, the 20th field after it
+    stats = stat[stat.rfind(')') + 2:].split(' ', 20)
 
     user_cputime = float(stats[11]) / _CLOCK_RATE
     system_cputime = float(stats[12]) / _CLOCK_RATE
 
-    return user_cputime + system_cputime
+    return user_cputime + system_cputime, stats[19]
 
 
-def get_system_cputime():
+def get_proc_cputime(pid, proc='/proc'):
+    """Sum proc user jiffies and system jiffies and return total time."""
+    return get_proc_times(pid, proc)[0]
+
+
+def service_from_cgroup(path):
+    """Return the service name of a cgroup path, or None.
+
+    The innermost container scope or systemd service in the path wins, so
+    a container started by docker.service is reported as the container.
+
+    """
+    for part in reversed(path.split('/')):
+        match = _CONTAINER_RE.match(part)
+        if match is not None:
+            return 'container_' + (match.group(1) or match.group(2))[:12]
+        if part.endswith('.service'):
+            return metric_safe(part[:-len('.service')])
+    return None
+
+
+def get_proc_service(pid, proc='/proc'):
+    """Return the service name of pid from its cgroup membership.
+
+    Uses the cgroup v2 hierarchy when mounted, falling back to the
+    name=systemd and then the cpu hierarchy of cgroup v1.
+
+    """
+    with open('%s/%s/cgroup' % (proc, pid)) as proc_cgroup:
+        lines = proc_cgroup.read().splitlines()
+
+    paths = {}
+    for line in lines:
+        _, controllers, path = line.split(':', 2)
+        for controller in controllers.split(','):
+            paths[controller] = path
+
+    for controller in ('', 'name=systemd', 'cpu'):
+        if controller in paths:
+            return service_from_cgroup(paths[controller])
+    return None
+
+
+def get_system_cputime(proc='/proc'):
     """Retrun total system cputime."""
-    with open('/proc/stat') as proc_stat:
-        stats = proc_stat.read().split()
+    # Only the aggregate cpu line is needed; the rest of /proc/stat grows
+    # with the number of cpus and interrupts
+    stat = read_proc_file('%s/stat' % proc, head=True)
+    stats = stat[:stat.find('\n')].split()
 
     return sum([float(s) / _CLOCK_RATE for s in stats[1:8]])
 
 
-class ProcessCpuCollector(diamond.collector.Collector):
+def summarize(samples):
+    """Return (max, 95th percentile, mean) of a non-empty list of samples."""
+    ordered = sorted(samples)
+    p95 = ordered[int(math.ceil(0.95 * len(ordered))) - 1]
+    return ordered[-1], p95, sum(ordered) / float(len(ordered))
+
+
+class CpuSampler(object):
+    """Sample the CPU usage of groups of pids from a background thread.
+
+    Each group's samples, as a percentage like the collected values, go
+    into a ring buffer of the newest `size` samples until drain()ed.
+
+    """
+    def __init__(self, interval, size, log, proc='/proc'):
+        self.interval = interval
+        self.size = size
+        self.log = log
+        self.proc = proc
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+        # name -> pids, replaced by the collector each collection
+        self._groups = {}
+        # name -> deque of samples since the last drain()
+        self._samples = {}
+        # pid -> cputime at the previous sample
+        self._cputimes = {}
+        self._sys_cputime = None
+
+    def set_groups(self, groups):
+        with self._lock:
+            self._groups = groups
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run,
+                                        name='processcpu-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        next_sample = time.time()
+        while not self._stopped:
+            next_sample += self.interval
+            time.sleep(max(next_sample - time.time(), 0))
+            try:
+                self.sample()
+            except Exception:
+                self.log.exception("Error sampling process cpu")
+
+    def sample(self):
+        """Record one sample for every group."""
+        with self._lock:
+            groups = self._groups
+
+        sys_cputime = get_system_cputime(self.proc)
+        last_cputimes = self._cputimes
+        cputimes = {}
+        usage = {}
+
+        for name, pids in groups.iteritems():
+            total = 0.0
+            for pid in pids:
+                try:
+                    cputime = get_proc_cputime(pid, self.proc)
+                except (IOError, OSError):
+                    # The process exited
+                    continue
+
+                cputimes[pid] = cputime
+                last_cputime = last_cputimes.get(pid)
+                # A pid reused by a new process goes backwards; skip it
+                # until it has a baseline
+                if last_cputime is not None and cputime >= last_cputime:
+                    total += cputime - last_cputime
+            usage[name] = total
+
+        last_sys_cputime = self._sys_cputime
+        self._cputimes = cputimes
+        self._sys_cputime = sys_cputime
+
+        if last_sys_cputime is None or sys_cputime <= last_sys_cputime:
+            return
+
+        delta_sys = sys_cputime - last_sys_cputime
+        with self._lock:
+            for name, total in usage.iteritems():
+                samples = self._samples.get(name)
+                if samples is None:
+                    samples = self._samples[name] = deque(maxlen=self.size)
+                samples.append((total / delta_sys) * 100.0 * _NUM_CPUS)
+
+    def drain(self):
+        """Return and forget the samples taken so far, by group."""
+        with self._lock:
+            samples, self._samples = self._samples, {}
+        return dict((name, list(values))
+                    for name, values in samples.iteritems() if values)
+
+
+class ProcessCpuCollector(CollectorStatsMixin, diamond.collector.Collector):
+
+    PROC = '/proc'
 
     __cache = defaultdict(dict)
 
@@ -204,7 +431,15 @@ class ProcessCpuCollector(diamond.collector.Collector):
                             self).get_default_config_help()
         config_help.update({
             'process': ("A subcategory of settings inside of which each "
-                        "collected process has it's configuration")
+                        "collected process has it's configuration"),
+            'discover': "Group every pid by its systemd unit or container",
+            'discover_top': ("Number of discovered services to publish, the "
+                             "rest are summed into services.other (0 for "
+                             "all)"),
+            'sample_interval': ("Seconds between background samples of "
+                                "the matched processes (0 to disable)"),
+            'sample_buffer': ("Number of samples kept per process between "
+                              "collections"),
         })
         return config_help
 
@@ -217,10 +452,33 @@ class ProcessCpuCollector(diamond.collector.Collector):
         config.update({
             'path':     'processcpu',
             'process':  '',
+            'discover': False,
+            'discover_top': 20,
+            'sample_interval': 0,
+            'sample_buffer': 600,
             'method':   'Threaded',
         })
         return config
 
+    def __init__(self, *args, **kwargs):
+        super(ProcessCpuCollector, self).__init__(*args, **kwargs)
+
+        # pid -> (starttime, service, cputime) from the last discovery
+        self._discovered = {}
+        self._discovered_sys = None
+
+        self._sampler = None
+
+    def get_sampler(self):
+        """Return the background sampler, (re)starting it if needed."""
+        if self._sampler is None:
+            self._sampler = CpuSampler(float(self.config['sample_interval']),
+                                       int(self.config['sample_buffer']),
+                                       self.log, self.PROC)
+        if not self._sampler.running():
+            self._sampler.start()
+        return self._sampler
+
     @classmethod
     def calc_deltas(cls, proc):
         """Calculate deltas of proc and sys cputime from previous run.
@@ -230,12 +488,12 @@ class ProcessCpuCollector(diamond.collector.Collector):
 
         """
         if proc not in cls.__cache:
-            cls.__cache[proc]['proc'] = get_proc_cputime(proc)
-            cls.__cache[proc]['sys'] = get_system_cputime()
+            cls.__cache[proc]['proc'] = get_proc_cputime(proc, cls.PROC)
+            cls.__cache[proc]['sys'] = get_system_cputime(cls.PROC)
             sleep(0.1)
 
-        proc_cputime = get_proc_cputime(proc)
-        sys_cputime = get_system_cputime()
+        proc_cputime = get_proc_cputime(proc, cls.PROC)
+        sys_cputime = get_system_cputime(cls.PROC)
 
         delta_proc = proc_cputime - cls.__cache[proc]['proc']
         delta_sys = sys_cputime - cls.__cache[proc]['sys']
@@ -249,7 +507,9 @@ class ProcessCpuCollector(diamond.collector.Collector):
         """Instantiate process filters from config file."""
         processes = defaultdict(list)
 
-        for process, cfg in self.config['process'].iteritems():
+        # 'process' is left as the empty string default when no [process]
+        # section is configured, e.g. with only discovery enabled
+        for process, cfg in (self.config['process'] or {}).iteritems():
             for filter_type in self.FILTERS:
                 if filter_type not in cfg:
                     continue
@@ -266,44 +526,149 @@ class ProcessCpuCollector(diamond.collector.Collector):
 
         return processes
 
+    def discover_services(self, entries):
+        """Return the CPU percentage of every service among the /proc
+        entries since the previous call.
+
+        A pid's cgroup is only read the first time it is seen with a given
+        starttime. The first call records a baseline and returns nothing.
+
+        """
+        sys_cputime = get_system_cputime(self.PROC)
+        previous = self._discovered
+        discovered = {}
+        cputimes = defaultdict(float)
+        cgroup_reads = 0
+
+        for pid in entries:
+            if not pid.isdigit():
+                continue
+
+            try:
+                cputime, starttime = get_proc_times(pid, self.PROC)
+                known = previous.get(pid)
+                if known is not None and known[0] == starttime:
+                    service, last_cputime = known[1], known[2]
+                else:
+                    # A pid not seen at the last call started since then,
+                    # so all of its cputime falls within this interval
+                    service = get_proc_service(pid, self.PROC)
+                    last_cputime = 0.0
+                    cgroup_reads += 1
+            except (IOError, OSError):
+                # The process exited while we were reading it
+                continue
+
+            discovered[pid] = (starttime, service, cputime)
+            if service is not None:
+                cputimes[service] += cputime - last_cputime
+
+        self.count_items('cgroup_reads', cgroup_reads)
+
+        last_sys_cputime = self._discovered_sys
+        self._discovered = discovered
+        self._discovered_sys = sys_cputime
+
+        if last_sys_cputime is None or sys_cputime <= last_sys_cputime:
+            return {}
+
+        delta_sys = sys_cputime - last_sys_cputime
+        return dict((service, (cputime / delta_sys) * 100.0 * _NUM_CPUS)
+                    for service, cputime in cputimes.iteritems())
+
+    def top_services(self, services):
+        """Keep the discover_top busiest services and sum the rest into
+        `other`.
+
+        """
+        top = int(self.config['discover_top'])
+        if not top or len(services) <= top:
+            return services
+
+        ranked = sorted(services.iteritems(), key=itemgetter(1),
+                        reverse=True)
+        kept = dict(ranked[:top])
+        kept['other'] = sum(cpu for _, cpu in ranked[top:])
+        return kept
+
+    @instrumented
     def collect(self):
         """Crawl /proc for any processes that match a filter and
             generate the data dict.
 
-        If no processes are defined, return immediately.
+        If no processes are defined and discovery is off, return
+        immediately.
 
         """
         processes = self.get_processes()
+        discover = str_to_bool(self.config['discover'])
 
-        if not processes:
+        if not processes and not discover:
             return
 
-        data = defaultdict(float)
+        with self.timed('discovery'):
+            matches = []
+            entries = os.listdir(self.PROC)
+            # With only discovery enabled there is nothing to match
+            for proc in (entries if processes else []):
+                proc_path = os.path.join(self.PROC, proc)
+                if not os.path.isdir(proc_path) or not proc.isdigit():
+                    continue
 
-        for proc in os.listdir('/proc'):
-            proc_path = os.path.join('/proc', proc)
-            if not os.path.isdir(proc_path) or not proc.isdigit():
-                continue
+                for name, filters in processes.iteritems():
+                    for proc_filter in filters:
+                        if proc_filter.match(proc_path):
+                            matches.append((name, proc))
+
+        self.count_items('proc_entries', len(entries))
+        self.count_items('matched', len(matches))
+
+        data = defaultdict(float)
 
-            for name, filters in processes.iteritems():
-                for proc_filter in filters:
-                    if not proc_filter.match(proc_path):
-                        continue
+        with self.timed('fetch'):
+            for name, proc in matches:
+                delta_proc, delta_sys = self.calc_deltas(proc)
 
+                # If the PID changed the delta will most likely be negative
+                # So delete the proc from the cache and re-calculate
+                if delta_proc < 0.0:
+                    del self.__cache[proc]
                     delta_proc, delta_sys = self.calc_deltas(proc)
 
-                    # If the PID changed the delta will most likely be negative
-                    # So delete the proc from the cache and re-calculate
-                    if delta_proc < 0.0:
-                        del self.__cache[proc]
-                        delta_proc, delta_sys = self.calc_deltas(proc)
-
-                    try:
-                        # Turn into total percentage 100% * num of CPUs
-                        data[name] += ((delta_proc / delta_sys) * 100.0
-                                       * _NUM_CPUS)
-                    except ZeroDivisionError:
-                        data[name] += 0.0
-
-        for metric, value in data.iteritems():
-            self.publish(metric, value)
+                try:
+                    # Turn into total percentage 100% * num of CPUs
+                    data[name] += ((delta_proc / delta_sys) * 100.0
+                                   * _NUM_CPUS)
+                except ZeroDivisionError:
+                    data[name] += 0.0
+
+        sampled = {}
+        if float(self.config['sample_interval']) > 0:
+            sampler = self.get_sampler()
+            sampled = sampler.drain()
+            self.count_items('samples', sum(map(len, sampled.itervalues())))
+            # A pid matching several filters of a group is sampled once
+            groups = defaultdict(set)
+            for name, proc in matches:
+                groups[name].add(proc)
+            sampler.set_groups(dict(groups))
+
+        services = {}
+        if discover:
+            with self.timed('services'):
+                services = self.discover_services(entries)
+            self.count_items('services', len(services))
+            services = self.top_services(services)
+
+        with self.timed('publish'):
+            batch = MetricBatch.for_collector(self)
+            for metric, value in data.iteritems():
+                batch.add(metric, value)
+            for service, value in services.iteritems():
+                batch.add('services.' + service, value)
+            for name, samples in sampled.iteritems():
+                high, p95, mean = summarize(samples)
+                batch.add('sampled.%s.max' % name, high)
+                batch.add('sampled.%s.p95' % name, p95)
+                batch.add('sampled.%s.mean' % name, mean)
+            batch.flush()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+"""
+Micro-benchmark of ProcessCpuCollector /proc parsing.
+
+Compares get_proc_cputime(), get_system_cputime() and CMDLineFilter against
+the file object and full split() parsing they used to do, over a synthetic
+/proc tree of stat and cmdline files.
+
+    python test/bench_processcpu.py [pids] [rounds] [cpus]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from processcpu import (
+    CMDLineFilter,
+    _CLOCK_RATE,
+    get_proc_cputime,
+    get_system_cputime,
+)
+
+###############################################################################
+
+COMMS = ['haproxy', 'nginx', 'tmux: server', 'weird ) (name']
+
+
+def make_proc(root, pids, cpus):
+    with open(os.path.join(root, 'stat'), 'w') as fp:
+        fp.write('cpu  1 2 3 4 5 6 7 0 0 0\n')
+        for cpu in xrange(cpus):
+            fp.write('cpu%d 1 2 3 4 5 6 7 0 0 0\n' % cpu)
+        fp.write('intr %s\n' % ' '.join(['12345'] * 1000))
+
+    for pid in pids:
+        comm = COMMS[pid % len(COMMS)]
+        fields = ['S', '1', str(pid), str(pid), '0', '-1', '4202752', '1500',
+                  '0', '3', '0', str(pid * 7), str(pid * 3), '0', '0', '20',
+                  '0', '1', '0', str(pid * 11), '104857600', '2048']
+        fields.extend(['18446744073709551615'] * 30)
+        os.mkdir(os.path.join(root, str(pid)))
+        with open(os.path.join(root, str(pid), 'stat'), 'w') as fp:
+            fp.write('%d (%s) %s\n' % (pid, comm, ' '.join(fields)))
+        with open(os.path.join(root, str(pid), 'cmdline'), 'w') as fp:
+            fp.write('/usr/sbin/%s\x00-f\x00/etc/%s/%d.cfg\x00'
+                     % (comm.split()[0], comm.split()[0], pid))
+
+
+def old_proc_cputime(pid, proc):
+    with open('%s/%s/stat' % (proc, pid)) as proc_stat:
+        stat = proc_stat.read().strip()
+
+    stats = stat[stat.rfind(')') + 2:].split()
+
+    user_cputime = float(stats[11]) / _CLOCK_RATE
+    system_cputime = float(stats[12]) / _CLOCK_RATE
+
+    return user_cputime + system_cputime
+
+
+def old_system_cputime(proc):
+    with open('%s/stat' % proc) as proc_stat:
+        stats = proc_stat.read().split()
+
+    return sum([float(s) / _CLOCK_RATE for s in stats[1:8]])
+
+
+class OldCMDLineFilter(CMDLineFilter):
+    def _filter(self, on):
+        with open(os.path.join(on, 'cmdline')) as fp:
+            cmdline = fp.read().strip()
+
+        cmdline = ' '.join(cmdline.split('\x00'))
+        return self.filter_re.search(cmdline) is not None
+
+
+def main(count=5000, rounds=10, cpus=64):
+    proc = tempfile.mkdtemp()
+    try:
+        pids = [str(pid) for pid in xrange(100, 100 + count)]
+        make_proc(proc, [int(pid) for pid in pids], cpus)
+        paths = [os.path.join(proc, pid) for pid in pids]
+
+        assert all(old_proc_cputime(pid, proc) == get_proc_cputime(pid, proc)
+                   for pid in pids)
+        assert old_system_cputime(proc) == get_system_cputime(proc)
+
+        old_filter = OldCMDLineFilter(r'haproxy -f /etc/haproxy/')
+        new_filter = CMDLineFilter(r'haproxy -f /etc/haproxy/')
+
+        cases = [
+            ('stat', count,
+             lambda: [old_proc_cputime(pid, proc) for pid in pids],
+             lambda: [get_proc_cputime(pid, proc) for pid in pids]),
+            ('cmdline', count,
+             lambda: [old_filter.match(path) for path in paths],
+             lambda: [new_filter.match(path) for path in paths]),
+            ('sys stat', 1,
+             lambda: old_system_cputime(proc),
+             lambda: get_system_cputime(proc)),
+        ]
+        for label, per, old, new in cases:
+            old_best = min(timeit.repeat(old, number=1, repeat=rounds))
+            new_best = min(timeit.repeat(new, number=1, repeat=rounds))
+            print '%-10s old %8.2f us  new %8.2f us  per call  (%.1fx)' % (
+                label, old_best * 1e6 / per, new_best * 1e6 / per,
+                old_best / new_best)
+    finally:
+        shutil.rmtree(proc)
+
+
+###############################################################################
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+import os
+import shutil
+import tempfile
+
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import patch
+
+from diamond.collector import Collector
+import processcpu
+from processcpu import (
+    CMDLineFilter,
+    CpuSampler,
+    ProcessCpuCollector,
+    get_proc_service,
+    get_proc_times,
+    read_proc_file,
+    service_from_cgroup,
+    summarize,
+)
+
+###############################################################################
+
+CONTAINER_ID = '4f1c2d3e5a6b' + '0' * 52
+
+
+def write_stat(proc, pid, comm, cputime, starttime):
+    # utime and stime are the 14th and 15th fields, starttime the 22nd
+    fields = ['S'] + ['0'] * 10 + [str(cputime), '0'] + ['0'] * 6 + \
+        [str(starttime)] + ['0'] * 30
+    with open(os.path.join(proc, str(pid), 'stat'), 'w') as fp:
+        fp.write('%d (%s) %s\n' % (pid, comm, ' '.join(fields)))
+
+
+def write_system_stat(proc, jiffies):
+    with open(os.path.join(proc, 'stat'), 'w') as fp:
+        fp.write('cpu  %d 0 0 0 0 0 0 0 0 0\n' % jiffies)
+
+
+def add_pid(proc, pid, comm, cputime, starttime, cgroup):
+    os.mkdir(os.path.join(proc, str(pid)))
+    write_stat(proc, pid, comm, cputime, starttime)
+    with open(os.path.join(proc, str(pid), 'cgroup'), 'w') as fp:
+        fp.write(cgroup)
+
+
+class TestServiceFromCgroup(unittest.TestCase):
+    def test_systemd_service(self):
+        self.assertEqual(service_from_cgroup('/system.slice/haproxy.service'),
+                         'haproxy')
+
+    def test_user_service(self):
+        self.assertEqual(
+            service_from_cgroup('/user.slice/user-1000.slice/'
+                                'user@1000.service/app.slice'),
+            'user_1000')
+
+    def test_container(self):
+        self.assertEqual(
+            service_from_cgroup('/system.slice/docker-%s.scope'
+                                % CONTAINER_ID),
+            'container_4f1c2d3e5a6b')
+        self.assertEqual(service_from_cgroup('/docker/%s' % CONTAINER_ID),
+                         'container_4f1c2d3e5a6b')
+
+    def test_no_service(self):
+        self.assertEqual(service_from_cgroup('/'), None)
+        self.assertEqual(
+            service_from_cgroup('/user.slice/user-1000.slice/session-2.scope'),
+            None)
+
+
+class TestSummarize(unittest.TestCase):
+    def test_summarize(self):
+        self.assertEqual(summarize(range(1, 101)), (100, 95, 50.5))
+        self.assertEqual(summarize([3.0]), (3.0, 3.0, 3.0))
+
+
+class TestCpuSampler(unittest.TestCase):
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        write_system_stat(self.proc, 1000)
+        add_pid(self.proc, 100, 'haproxy', 10, 5, '0::/\n')
+        add_pid(self.proc, 101, 'haproxy', 10, 5, '0::/\n')
+
+        self.sampler = CpuSampler(1, 2, None, self.proc)
+        self.sampler.set_groups({'haproxy': ['100', '101'],
+                                 'gone': ['999']})
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def tick(self, jiffies, haproxy):
+        write_system_stat(self.proc, jiffies)
+        write_stat(self.proc, 100, 'haproxy', haproxy, 5)
+        self.sampler.sample()
+
+    def drain(self):
+        return dict((name, [round(value, 6) for value in values])
+                    for name, values in self.sampler.drain().iteritems())
+
+    @patch.object(processcpu, '_NUM_CPUS', 1)
+    def test_sample(self):
+        self.sampler.sample()
+        self.assertEqual(self.drain(), {})
+
+        self.tick(1100, 30)
+        self.tick(1200, 40)
+        self.assertEqual(self.drain(),
+                         {'haproxy': [20.0, 10.0], 'gone': [0.0, 0.0]})
+        self.assertEqual(self.drain(), {})
+
+    @patch.object(processcpu, '_NUM_CPUS', 1)
+    def test_ring_buffer_keeps_newest(self):
+        self.sampler.sample()
+        for i in xrange(1, 4):
+            self.tick(1000 + 100 * i, 10 + 10 * i)
+
+        self.assertEqual(self.drain()['haproxy'], [10.0, 10.0])
+
+
+class TestSampledCollect(CollectorTestCase):
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        write_system_stat(self.proc, 1000)
+        add_pid(self.proc, 100, 'haproxy', 10, 5, '0::/\n')
+        with open(os.path.join(self.proc, '100', 'cmdline'), 'w') as fp:
+            fp.write('/usr/sbin/haproxy\x00-f\x00/etc/haproxy/misc.cfg\x00')
+        self.pidfile = os.path.join(self.proc, 'haproxy.pid')
+        with open(self.pidfile, 'w') as fp:
+            fp.write('100\n')
+
+        config = get_collector_config('ProcessCpuCollector', {
+            'interval': 10,
+            'sample_interval': 1,
+            'process': {'haproxy': {'pidfile': self.pidfile,
+                                    'cmdline': 'haproxy -f'}},
+        })
+        self.collector = ProcessCpuCollector(config, None)
+        # calc_deltas() is a classmethod reading the class attribute
+        self.proc_patch = patch.object(ProcessCpuCollector, 'PROC', self.proc)
+        self.proc_patch.start()
+
+    def tearDown(self):
+        self.proc_patch.stop()
+        shutil.rmtree(self.proc)
+
+    @patch.object(processcpu, '_NUM_CPUS', 1)
+    @patch.object(CpuSampler, 'start')
+    @patch.object(Collector, 'publish_metric')
+    def test_pid_matching_several_filters_sampled_once(self, publish_metric,
+                                                        start):
+        self.collector.collect()
+        sampler = self.collector._sampler
+        self.assertEqual(sampler._groups, {'haproxy': set(['100'])})
+
+        sampler.sample()
+        write_system_stat(self.proc, 1100)
+        write_stat(self.proc, 100, 'haproxy', 30, 5)
+        sampler.sample()
+        self.collector.collect()
+
+        metrics = dict((call[0][0].path, call[0][0].value)
+                       for call in publish_metric.call_args_list)
+        self.assertAlmostEqual(
+            metrics[self.collector.get_metric_path('sampled.haproxy.max')],
+            20.0)
+
+
+class TestProcessCpuCollector(CollectorTestCase):
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        write_system_stat(self.proc, 1000)
+        add_pid(self.proc, 100, 'haproxy', 10, 5,
+                '0::/system.slice/haproxy.service\n')
+        add_pid(self.proc, 101, 'weird ) (name', 20, 6,
+                '12:cpu,cpuacct:/system.slice/nginx.service\n'
+                '1:name=systemd:/system.slice/nginx.service\n')
+        add_pid(self.proc, 102, 'kworker/0:1', 30, 7, '0::/\n')
+
+        config = get_collector_config('ProcessCpuCollector', {
+            'interval': 10,
+            'discover': True,
+            'discover_top': 0,
+        })
+        self.collector = ProcessCpuCollector(config, None)
+        self.collector.PROC = self.proc
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def test_get_proc_times(self):
+        cputime, starttime = get_proc_times(101, self.proc)
+        self.assertEqual(cputime, 20.0 / processcpu._CLOCK_RATE)
+        self.assertEqual(starttime, '6')
+
+    def test_read_proc_file(self):
+        path = os.path.join(self.proc, 'big')
+        with open(path, 'w') as fp:
+            fp.write('x' * 10000)
+
+        self.assertEqual(read_proc_file(path, size=4096), 'x' * 10000)
+        self.assertEqual(read_proc_file(path, size=4096, head=True),
+                         'x' * 4096)
+
+    def test_cmdline_filter(self):
+        with open(os.path.join(self.proc, '100', 'cmdline'), 'w') as fp:
+            fp.write('/usr/sbin/haproxy\x00-f\x00/etc/haproxy/misc.cfg\x00')
+
+        proc_path = os.path.join(self.proc, '100')
+        self.assertTrue(CMDLineFilter('haproxy -f /etc/haproxy/misc')
+                        .match(proc_path))
+        self.assertFalse(CMDLineFilter('haproxy -f /etc/haproxy/web')
+                         .match(proc_path))
+
+    def test_get_proc_service(self):
+        self.assertEqual(get_proc_service(100, self.proc), 'haproxy')
+        self.assertEqual(get_proc_service(101, self.proc), 'nginx')
+        self.assertEqual(get_proc_service(102, self.proc), None)
+
+    @patch.object(processcpu, '_NUM_CPUS', 1)
+    def test_discover_services(self):
+        entries = os.listdir(self.proc)
+        self.assertEqual(self.collector.discover_services(entries), {})
+
+        write_system_stat(self.proc, 1100)
+        write_stat(self.proc, 100, 'haproxy', 60, 5)
+        # pid 101 was reused by a new process since the last call
+        write_stat(self.proc, 101, 'weird ) (name', 10, 900)
+        with patch.object(processcpu, 'get_proc_service',
+                          return_value='nginx') as get_service:
+            services = self.collector.discover_services(entries)
+            get_service.assert_called_once_with('101', self.proc)
+
+        self.assertEqual(services, {'haproxy': 50.0, 'nginx': 10.0})
+
+    def test_top_services(self):
+        self.collector.config['discover_top'] = 2
+        self.assertEqual(
+            self.collector.top_services({'a': 5.0, 'b': 1.0, 'c': 3.0,
+                                         'd': 2.0}),
+            {'a': 5.0, 'c': 3.0, 'other': 3.0})
+
+    @patch.object(Collector, 'publish_metric')
+    def test_collect_services(self, publish_metric):
+        self.collector.collect()
+        write_system_stat(self.proc, 1100)
+        write_stat(self.proc, 100, 'haproxy', 60, 5)
+        self.collector.collect()
+
+        paths = [call[0][0].path for call in publish_metric.call_args_list]
+        self.assertTrue(
+            self.collector.get_metric_path('services.haproxy') in paths)
+        self.assertTrue(
+            self.collector.get_metric_path('services.nginx') in paths)
+
+###############################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -3,48 +3,172 @@
 """
 Collect stats via zk from storm and kafka
 
+Spout partition state nodes are cached by znode path and `mzxid`, so only
+nodes written since the previous collection are fetched and decoded. Broker
+offsets are still requested for every partition (the latest offset moves
+independently of the spout's commits) but are batched into two requests per
+broker, one for the earliest and one for the latest offsets, over a reused
+connection.
+
+Several Storm clusters can be monitored from one collector. Each cluster is
+collected in its own thread and keeps its ZooKeeper client connected between
+collections. A cluster that fails is backed off exponentially, and one whose
+previous collection has not finished is skipped.
+
+Example config file StormKafkaMonitorCollector.conf
+
+```
+enabled=True
+[clusters]
+[[prod]]
+zookeeper = zoo-1.i.disqus.net:2181,zoo-2.i.disqus.net:2181
+spout_root = /kafkastorm
+[[staging]]
+zookeeper = zoo-1.staging.disqus.net:2181
+prefix = staging.storm
+```
+
+zookeeper
+- Kazoo connection string, defaults to the collector's `zookeeper` setting
+
+spout_root
+- Root of the spout state nodes, defaults to the collector's `spout_root`
+
+prefix
+- Metric prefix for the cluster, defaults to the section name
+
+Without a `[clusters]` section a single cluster is collected from the
+top-level `zookeeper` and `spout_root` settings with no extra prefix.
+
 #### Dependencies
 
  * stormkafkamon
+ * kazoo
 """
 
 import re
+import threading
+from collections import defaultdict
 from random import randint
 
 try:
-    from stormkafkamon.monitor import (
-        process,
-        ZkClient,
-    )
+    import json
+    json  # workaround for pyflakes issue #13
 except ImportError:
-    proccess = None
-    ZkClient = None
+    import simplejson as json
+
+try:
+    from kafka.client import KafkaClient
+    from kafka.common import OffsetRequest
+    from kazoo.client import KazooClient
+    from stormkafkamon.processor import (
+        PartitionsSummary,
+        PartitionState,
+    )
+except ImportError, err:
+    KafkaClient = None
+    OffsetRequest = None
+    KazooClient = None
+    PartitionsSummary = None
+    PartitionState = None
+    IMPORT_ERROR = str(err)
+else:
+    IMPORT_ERROR = None
 
 import diamond.collector
+from diamond.collector import str_to_bool
 
+from asyncfetch import zk_pipeline
+from collectorstats import CollectorStatsMixin, instrumented
+from metricbatch import MetricBatch
+from pollschedule import PollScheduleMixin, scheduled
 
-class StormKafkaMonitorCollector(diamond.collector.Collector):
+
+class SpoutCluster(object):
+    """
+    Connection and cache state for a single Storm ZooKeeper cluster.
+    """
+    def __init__(self, name, zookeeper, spout_root, prefix):
+        self.name = name
+        self.zookeeper = zookeeper
+        self.spout_root = spout_root
+        self.prefix = prefix
+
+        self.zk = None
+        # Thread of the latest collection of this cluster
+        self.thread = None
+        # znode path -> (mzxid, decoded partition state)
+        self.spout_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (host, port) -> KafkaClient
+        self.kafka_clients = {}
+
+
+class StormKafkaMonitorCollector(CollectorStatsMixin, PollScheduleMixin,
+                                 diamond.collector.Collector):
     topology_pattern = re.compile(r'(.*?)-\d+-\d+')
-    zookeeper_server = 'zoo-1.i.disqus.net'
-    zookeeper_port = 2181   # Default port
-    spout_root = '/kafkastorm'
+    partition_excluded = frozenset(['broker', 'topic', 'partition', 'spout'])
+
+    def __init__(self, *args, **kwargs):
+        super(StormKafkaMonitorCollector, self).__init__(*args, **kwargs)
+
+        if IMPORT_ERROR is not None:
+            self.log.error("StormKafkaMonitorCollector needs kafka-python, "
+                           "kazoo and stormkafkamon: %s", IMPORT_ERROR)
+
+        self._clusters = None
+        # Indices of the PartitionState fields that are published
+        self._partition_indices = None
+        # (prefix, broker, partition, topic) -> ((metric name, index), ...)
+        self._partition_metrics = {}
+        # Keys of _partition_metrics used since the last prune
+        self._partition_metrics_seen = set()
+
+    def get_clusters(self):
+        """
+        Build the list of clusters to collect from the config, once.
+        """
+        if self._clusters is None:
+            sections = self.config['clusters'] or {'': {}}
+
+            clusters = []
+            for name, cfg in sorted(sections.iteritems()):
+                clusters.append(SpoutCluster(
+                    name,
+                    cfg.get('zookeeper', self.config['zookeeper']),
+                    cfg.get('spout_root', self.config['spout_root']),
+                    cfg.get('prefix', name),
+                ))
+            self._clusters = clusters
+        return self._clusters
 
-    def get_zk_client(self):
+    def get_zk_client(self, cluster):
         """
-        Lazy zk client.
+        Lazy zk client, kept connected between collections.
         """
-        if not hasattr(self, '_zk'):
-            self._zk = ZkClient(self.zookeeper_server, self.zookeeper_port)
-        return self._zk
+        if cluster.zk is None:
+            cluster.zk = KazooClient(hosts=cluster.zookeeper)
+        if not cluster.zk.connected:
+            cluster.zk.start(timeout=min(float(self.config['zk_timeout']),
+                                         self.request_timeout()))
+        return cluster.zk
 
-    def running_topologies(self):
+    def get_kafka_client(self, cluster, host, port):
+        """
+        Lazy kafka client per broker.
+        """
+        key = (host, port)
+        if key not in cluster.kafka_clients:
+            cluster.kafka_clients[key] = KafkaClient(host, str(port))
+        return cluster.kafka_clients[key]
+
+    def running_topologies(self, cluster):
         """
         Retrieve a list of all running topologies from zookeeper.
         """
-        zk = self.get_zk_client()
-        zk.client.start()
-        raw_storms = zk.client.get_children('/storm/storms')
-        zk.client.stop()
+        zk = self.get_zk_client(cluster)
+        raw_storms = self.zk_read(zk, 'get_children', ['/storm/storms'])[0]
 
         storms = []
 
@@ -60,24 +184,179 @@ class StormKafkaMonitorCollector(diamond.collector.Collector):
             storms.append(groups[0])
         return storms
 
-    def get_topology_summary(self, topology):
-        zk = self.get_zk_client()
-        zk.client.start()
-        retval = process(zk.spouts(self.spout_root, topology))
-        zk.client.stop()
-        return retval
+    def get_spout_states(self, cluster):
+        """
+        Retrieve the state of every spout partition under spout_root.
+
+        Nodes whose mzxid is unchanged since the last call are served from
+        the cache; only modified or new nodes are fetched and decoded.
+        Returns a dict of topology name -> list of (spout id, state).
+        """
+        zk = self.get_zk_client(cluster)
+        cache = cluster.spout_cache
+
+        children = self.zk_read(zk, 'get_children', [cluster.spout_root])[0]
+        paths = ['/'.join([cluster.spout_root, child]) for child in children]
+        stats = self.zk_read(zk, 'exists', paths)
+
+        misses = []
+        for path, stat in zip(paths, stats):
+            cached = cache.get(path)
+            # A stat of None means the node was removed since the listing
+            if stat is not None and (cached is None
+                                     or cached[0] != stat.mzxid):
+                misses.append(path)
+
+        cluster.cache_misses += len(misses)
+        for path, (data, stat) in zip(misses,
+                                      self.zk_read(zk, 'get', misses)):
+            self.count_bytes('znodes', len(data))
+            cache[path] = (stat.mzxid, json.loads(data))
+
+        seen = set()
+        spouts = defaultdict(list)
+        for child, path, stat in zip(children, paths, stats):
+            if stat is None:
+                continue
+
+            state = cache[path][1]
+            seen.add(path)
+            spouts[state['topology']['name']].append((child, state))
+
+        cluster.cache_hits += len(seen) - len(misses)
+
+        for path in set(cache) - seen:
+            del cache[path]
+
+        return spouts
+
+    def zk_read(self, zk, method, paths):
+        """
+        Call zk.<method>(path) for every path through kazoo's async API,
+        waiting no longer than the time left in the collection; raises
+        DeadlineExceeded once it has run out.
+
+        The reads are pipelined when async_fetch is enabled and made one at
+        a time otherwise.
+        """
+        if str_to_bool(self.config['async_fetch']):
+            return zk_pipeline(zk, method, paths, self.request_timeout())
+
+        call = getattr(zk, method + '_async')
+        results = []
+        for path in paths:
+            timeout = self.request_timeout()
+            results.append(call(path).get(timeout=timeout))
+        return results
+
+    def get_broker_offsets(self, cluster, states):
+        """
+        Fetch the earliest and latest offsets for each partition in states,
+        sending one batched request per broker for each.
+
+        Kafka keys offset requests by (topic, partition), so the earliest and
+        latest offset of a partition cannot share a request: the second would
+        replace the first.
 
-    def get_summaries(self):
+        Returns a dict of (host, topic, partition) -> (earliest, latest).
+        """
+        by_broker = defaultdict(list)
+        for state in states:
+            broker = state['broker']
+            by_broker[(broker['host'], broker['port'])].append(state)
+
+        offsets = {}
+        for (host, port), broker_states in by_broker.iteritems():
+            client = self.get_kafka_client(cluster, host, port)
+            try:
+                earliest, latest = [
+                    client.send_offset_request([
+                        OffsetRequest(str(state['topic']), state['partition'],
+                                      time, 1)
+                        for state in broker_states])
+                    for time in (-2, -1)]
+            except Exception:
+                # Reconnect on the next collection
+                cluster.kafka_clients.pop((host, port), None)
+                raise
+
+            for state, first, last in zip(broker_states, earliest, latest):
+                key = (host, state['topic'], state['partition'])
+                offsets[key] = (first.offsets[0], last.offsets[0])
+
+        return offsets
+
+    def get_topology_summary(self, cluster, spouts):
+        """
+        Build a PartitionsSummary from a list of (spout id, state).
+        """
+        offsets = self.get_broker_offsets(
+            cluster, [state for _, state in spouts])
+
+        results = []
+        total_depth = 0
+        total_delta = 0
+        brokers = set()
+        for spout_id, state in spouts:
+            host = state['broker']['host']
+            earliest, latest = offsets[
+                (host, state['topic'], state['partition'])]
+            current = state['offset']
+
+            brokers.add(host)
+            total_depth += latest - earliest
+            total_delta += latest - current
+
+            results.append(PartitionState(
+                host,
+                state['topic'],
+                state['partition'],
+                earliest,
+                latest,
+                latest - earliest,
+                spout_id,
+                current,
+                latest - current,
+            ))
+
+        return PartitionsSummary(total_depth=total_depth,
+                                 total_delta=total_delta,
+                                 num_partitions=len(results),
+                                 num_brokers=len(brokers),
+                                 partitions=tuple(results))
+
+    def get_summaries(self, cluster):
         """
         Iterate over all running topologies and get their summaries.
         """
-        summaries = []
-        topologies = self.running_topologies()
-        for topology in topologies:
-            summary = self.get_topology_summary(topology)
-            summaries.append(summary)
+        with self.timed('discovery'):
+            topologies = self.running_topologies(cluster)
+        self.count_items('topologies', len(topologies))
+
+        with self.timed('fetch'):
+            spouts = self.get_spout_states(cluster)
+
+            summaries = []
+            for topology in topologies:
+                summary = self.get_topology_summary(
+                    cluster, spouts.get(topology, []))
+                summaries.append(summary)
         return zip(topologies, summaries)
 
+    def collect_cluster(self, cluster, results):
+        """
+        Collect the summaries of one cluster into results, logging rather
+        than raising so one unreachable cluster does not hide the others.
+        """
+        try:
+            results[cluster.name] = self.get_summaries(cluster)
+        except Exception:
+            self.endpoint_failed(cluster.name,
+                                 "Error collecting storm cluster %s",
+                                 cluster.zookeeper)
+        else:
+            self.endpoint_succeeded(cluster.name)
+
     def metric_name_from_state(self, partition_state):
         return '%s.%d.%s.' % (
             partition_state.broker.split('.', 1)[0],
@@ -85,47 +364,159 @@ class StormKafkaMonitorCollector(diamond.collector.Collector):
             partition_state.topic,
         )
 
-    def metrics_from_partition_state(self, partition_state):
-        excluded = frozenset(['broker', 'topic', 'partition', 'spout'])
-        prefix = self.metric_name_from_state(partition_state)
-        metrics = []
-        for metric in partition_state._fields:
-            if metric in excluded:
-                continue
-            metrics.append((prefix + metric, getattr(partition_state, metric)))
+    def partition_metrics(self, prefix, partition_state):
+        """
+        Return ((metric name, field index), ...) for partition_state.
+
+        The names are built once per (prefix, broker, partition, topic) and
+        reused on every later collection until pruned.
+        """
+        key = (prefix,
+               partition_state.broker,
+               partition_state.partition,
+               partition_state.topic)
+        self._partition_metrics_seen.add(key)
+        metrics = self._partition_metrics.get(key)
+        if metrics is None:
+            if self._partition_indices is None:
+                self._partition_indices = tuple(
+                    i for i, field in enumerate(partition_state._fields)
+                    if field not in self.partition_excluded)
+
+            name = prefix + self.metric_name_from_state(partition_state)
+            metrics = tuple((name + partition_state._fields[i], i)
+                            for i in self._partition_indices)
+            self._partition_metrics[key] = metrics
         return metrics
 
+    def prune_partition_metrics(self):
+        """
+        Forget the names of partitions not published since the last prune,
+        such as removed topologies or partitions that moved broker.
+        """
+        seen = self._partition_metrics_seen
+        for key in set(self._partition_metrics) - seen:
+            del self._partition_metrics[key]
+        self._partition_metrics_seen = set()
+
+    def metrics_from_partition_state(self, partition_state):
+        return [(metric, partition_state[i])
+                for metric, i in self.partition_metrics('', partition_state)]
+
+    def publish_partitions(self, batch, prefix, partitions):
+        """
+        Add every PartitionState in partitions to batch under prefix.
+        """
+        self.count_items('partitions', len(partitions))
+
+        partition_metrics = self.partition_metrics
+        add = batch.add
+        for partition_state in partitions:
+            for metric, i in partition_metrics(prefix, partition_state):
+                add(metric, partition_state[i])
+
+    def get_default_config_help(self):
+        config_help = super(StormKafkaMonitorCollector,
+                            self).get_default_config_help()
+        config_help.update({
+            'zookeeper': "Kazoo connection string of the storm zookeeper",
+            'spout_root': "Root node of the kafka spout state",
+            'zk_timeout': "Seconds to wait when connecting to zookeeper",
+            'async_fetch': "Pipeline zookeeper reads through kazoo's "
+                           "async API",
+            'dedup_heartbeat': "Re-publish unchanged values only every this "
+                               "many intervals (0 publishes every value)",
+            'clusters': ("A subcategory of settings inside of which each "
+                         "storm cluster has it's configuration"),
+        })
+        return config_help
+
     def get_default_config(self):
         """
         Returns the default collector settings.
         """
         config = super(StormKafkaMonitorCollector, self).get_default_config()
         config.update({
-            'host': '127.0.0.1',
-            'port': 7200,
+            'zookeeper': 'zoo-1.i.disqus.net:2181',
+            'spout_root': '/kafkastorm',
+            'zk_timeout': 10,
+            'async_fetch': False,
+            'dedup_heartbeat': 0,
+            'clusters': '',
             'path': 'storm.spout.kafka',
             'method': 'Threaded',
         })
         return config
 
+    @scheduled
+    @instrumented
     def collect(self):
-        partition_summaries = self.get_summaries()
+        if IMPORT_ERROR is not None:
+            return
+
+        clusters = self.get_clusters()
+        results = {}
+
+        threads = []
+        for cluster in clusters:
+            if cluster.thread is not None and cluster.thread.is_alive():
+                self.log.warning("Previous collection of storm cluster %s "
+                                 "still running, skipping",
+                                 cluster.zookeeper)
+                continue
+            if not self.endpoint_ready(cluster.name):
+                continue
+
+            cluster.cache_hits = 0
+            cluster.cache_misses = 0
+
+            cluster.thread = threading.Thread(target=self.collect_cluster,
+                                              args=(cluster, results))
+            cluster.thread.daemon = True
+            cluster.thread.start()
+            threads.append(cluster.thread)
+
+        for thread in threads:
+            thread.join(max(self.remaining(), 0))
+        # Clusters still running past the deadline publish nothing
+        results = dict(results)
+
+        with self.timed('publish'):
+            batch = MetricBatch.for_collector(self)
+            for cluster in clusters:
+                if cluster.name not in results:
+                    continue
+
+                cluster_prefix = ''
+                if cluster.prefix:
+                    cluster_prefix = cluster.prefix + '.'
+
+                batch.add(cluster_prefix + 'spout_cache.hits',
+                          cluster.cache_hits)
+                batch.add(cluster_prefix + 'spout_cache.misses',
+                          cluster.cache_misses)
+
+                for topology, partition_summary in results[cluster.name]:
+                    prefix = '%s%s.' % (cluster_prefix, topology)
+                    for metric in partition_summary._fields:
+                        # Set Metric Name
+                        metric_name = metric
 
-        for topology, partition_summary in partition_summaries:
-            prefix = '%s.' % topology
-            for metric in partition_summary._fields:
-                # Set Metric Name
-                metric_name = metric
+                        # Set Metric Value
+                        metric_value = getattr(partition_summary, metric)
 
-                # Set Metric Value
-                metric_value = getattr(partition_summary, metric)
+                        # Publish Metric
+                        if metric_name == 'partitions':
+                            self.publish_partitions(batch, prefix,
+                                                    metric_value)
 
-                # Publish Metric
-                if metric_name == 'partitions':
-                    for partition_state in metric_value:
-                        for metric, value in self.metrics_from_partition_state(partition_state):
-                            self.publish(prefix + metric, value)
+                        else:
+                            batch.add(prefix + metric_name, metric_value)
 
-                else:
-                    self.publish(prefix + metric_name, metric_value)
+            batch.flush()
 
+        # A cluster that failed this time loses its names and rebuilds them
+        # once it recovers; when nothing was collected there is nothing to
+        # prune against
+        if results:
+            self.prune_partition_metrics()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# coding=utf-8
+###############################################################################
+"""
+Micro-benchmark of StormKafkaMonitorCollector partition publishing.
+
+Compares the cached prefix and MetricBatch path used by collect() against
+rebuilding the metric names and calling publish() for every partition, with
+publish_metric() replaced by a no-op.
+
+    python test/bench_monitor.py [partitions] [rounds]
+"""
+import sys
+import timeit
+
+from test import get_collector_config
+
+from metricbatch import MetricBatch
+from storm_kafka_monitor import StormKafkaMonitorCollector
+
+from stormkafkamon.processor import PartitionState
+
+###############################################################################
+
+
+def make_partitions(count):
+    return tuple(
+        PartitionState('broker-%d.i.disqus.net' % (i % 8),
+                       'topic-%d' % (i % 50),
+                       i,
+                       0, 2000, 2000, 'spout', 1500, 500)
+        for i in xrange(count))
+
+
+def uncached(collector, prefix, partitions):
+    """The per-partition name building collect() used to do."""
+    excluded = frozenset(['broker', 'topic', 'partition', 'spout'])
+    for partition_state in partitions:
+        name = collector.metric_name_from_state(partition_state)
+        metrics = []
+        for metric in partition_state._fields:
+            if metric in excluded:
+                continue
+            metrics.append((name + metric, getattr(partition_state, metric)))
+        for metric, value in metrics:
+            collector.publish(prefix + metric, value)
+
+
+def main(count=5000, rounds=20):
+    config = get_collector_config('StormKafkaMonitorCollector', {})
+    collector = StormKafkaMonitorCollector(config, None)
+    collector.publish_metric = lambda metric: None
+
+    partitions = make_partitions(count)
+    prefix = 'prod.topology.'
+    batch = MetricBatch(collector)
+
+    def cached():
+        collector.publish_partitions(batch, prefix, partitions)
+        batch.flush()
+
+    # Warm the name caches as a previous collection would have
+    cached()
+
+    for label, func in [
+        ('uncached', lambda: uncached(collector, prefix, partitions)),
+        ('cached', cached),
+    ]:
+        best = min(timeit.repeat(func, number=1, repeat=rounds))
+        print '%-10s %8.3f ms per 1000 partitions  %10.0f partitions/s' % (
+            label, best * 1000.0 * 1000 / count, count / best)
+
+
+###############################################################################
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,13 +1,18 @@
 #!/usr/bin/python
 # coding=utf-8
 ###############################################################################
+import time
+from collections import namedtuple
+
 from test import CollectorTestCase
 from test import get_collector_config
 from test import unittest
-from mock import patch
+from mock import MagicMock, patch
 
 from diamond.collector import Collector
+import storm_kafka_monitor
 from storm_kafka_monitor import StormKafkaMonitorCollector
+from pollschedule import DeadlineExceeded
 
 from stormkafkamon.processor import (
     PartitionsSummary,
@@ -16,6 +21,50 @@ from stormkafkamon.processor import (
 
 ###############################################################################
 
+class AsyncResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+
+OffsetResponse = namedtuple('OffsetResponse',
+                            ['topic', 'partition', 'error', 'offsets'])
+
+
+class FakeKafkaClient(object):
+    """Answer offset requests the way kafka-python does: payloads are keyed
+    by (topic, partition), so a later one replaces an earlier one."""
+    def __init__(self, offsets):
+        # (topic, partition) -> (earliest, latest)
+        self.offsets = offsets
+        self.requests = []
+
+    def send_offset_request(self, payloads):
+        self.requests.append(payloads)
+        by_key = dict(((p.topic, p.partition), p) for p in payloads)
+        responses = {}
+        for key, payload in by_key.iteritems():
+            earliest, latest = self.offsets[key]
+            responses[key] = OffsetResponse(
+                payload.topic, payload.partition, 0,
+                [earliest if payload.time == -2 else latest])
+        return [responses[(p.topic, p.partition)] for p in payloads]
+
+
+def spout_state(partition, offset, host='broker.local'):
+    return {'topology': {'name': 'topo'}, 'offset': offset,
+            'partition': partition, 'topic': 'foo',
+            'broker': {'host': host, 'port': 9092}}
+
+
+def published(collector, publish_metric_mock):
+    """Map metric name -> value of every Metric passed to publish_metric."""
+    root = collector.get_metric_path('')
+    return dict((call[0][0].path[len(root):], call[0][0].value)
+                for call in publish_metric_mock.call_args_list)
+
 
 class TestStormKafkaMonitorCollector(CollectorTestCase):
     def setUp(self):
@@ -24,16 +73,18 @@ class TestStormKafkaMonitorCollector(CollectorTestCase):
         })
 
         self.collector = StormKafkaMonitorCollector(config, None)
+        self.cluster = self.collector.get_clusters()[0]
 
     @patch.object(StormKafkaMonitorCollector, 'get_zk_client')
     def test_running_topologies(self, zk):
         # Running topologies
-        zk.return_value.client.get_children.return_value = [
+        zk.return_value.get_children_async.return_value = AsyncResult([
             'foo-1-123123',
             'bar-12-456778',
-        ]
+        ])
 
-        self.assertEqual(['foo', 'bar'], self.collector.running_topologies())
+        self.assertEqual(['foo', 'bar'],
+                         self.collector.running_topologies(self.cluster))
 
     @patch.object(StormKafkaMonitorCollector, 'get_zk_client')
     def test_metric_name_from_partition_state(self, zk):
@@ -51,7 +102,114 @@ class TestStormKafkaMonitorCollector(CollectorTestCase):
             ('broker.0.foo.delta', 0),
         ])
 
-    @patch.object(Collector, 'publish')
+    def test_partition_metrics_cached(self):
+        partition_state = PartitionState('broker.local','foo',0,2000,1000,0,'topo',1000,0)
+        metrics = self.collector.partition_metrics('topo.', partition_state)
+        self.assertEqual(metrics, (
+            ('topo.broker.0.foo.earliest', 3),
+            ('topo.broker.0.foo.latest', 4),
+            ('topo.broker.0.foo.depth', 5),
+            ('topo.broker.0.foo.current', 7),
+            ('topo.broker.0.foo.delta', 8),
+        ))
+        self.assertTrue(
+            self.collector.partition_metrics('topo.', partition_state) is metrics)
+
+    def test_prune_partition_metrics(self):
+        kept = PartitionState('broker.local','foo',0,2000,1000,0,'topo',1000,0)
+        moved = PartitionState('broker.local','foo',1,2000,1000,0,'topo',1000,0)
+        self.collector.partition_metrics('topo.', kept)
+        self.collector.partition_metrics('topo.', moved)
+        self.collector.prune_partition_metrics()
+        self.assertEqual(len(self.collector._partition_metrics), 2)
+
+        self.collector.partition_metrics('topo.', kept)
+        self.collector.prune_partition_metrics()
+        self.assertEqual(self.collector._partition_metrics.keys(),
+                         [('topo.', 'broker.local', 0, 'foo')])
+
+    @patch.object(StormKafkaMonitorCollector, 'get_zk_client')
+    def test_spout_states_cached_by_mzxid(self, zk):
+        state = ('{"topology": {"name": "topo"}, "offset": 1000, '
+                 '"partition": 0, "topic": "foo", '
+                 '"broker": {"host": "broker.local", "port": 9092}}')
+        client = zk.return_value
+        client.get_children_async.return_value = AsyncResult(['partition_0'])
+        client.exists_async.return_value = AsyncResult(MagicMock(mzxid=10))
+        client.get_async.return_value = AsyncResult(
+            (state, MagicMock(mzxid=10)))
+
+        first = self.collector.get_spout_states(self.cluster)
+        second = self.collector.get_spout_states(self.cluster)
+
+        self.assertEqual(first, second)
+        self.assertEqual(second['topo'][0][0], 'partition_0')
+        self.assertEqual(client.get_async.call_count, 1)
+        self.assertEqual(self.cluster.cache_hits, 1)
+        self.assertEqual(self.cluster.cache_misses, 1)
+
+        # A write bumps the mzxid and forces a re-read
+        client.exists_async.return_value = AsyncResult(MagicMock(mzxid=11))
+        client.get_async.return_value = AsyncResult(
+            (state, MagicMock(mzxid=11)))
+        self.collector.get_spout_states(self.cluster)
+        self.assertEqual(client.get_async.call_count, 2)
+
+    def test_zk_read_bounded_by_deadline(self):
+        zk = MagicMock()
+        self.collector._deadline = time.time() + 5
+
+        self.collector.zk_read(zk, 'get', ['/a', '/b'])
+        for call in zk.get_async.return_value.get.call_args_list:
+            self.assertTrue(0 < call[1]['timeout'] <= 5)
+
+    def test_zk_read_past_deadline(self):
+        zk = MagicMock()
+        self.collector._deadline = time.time() - 1
+
+        self.assertRaises(DeadlineExceeded, self.collector.zk_read,
+                          zk, 'get_children', ['/storm/storms'])
+        self.assertFalse(zk.get_children_async.called)
+
+    @patch.object(StormKafkaMonitorCollector, 'get_kafka_client')
+    def test_get_broker_offsets(self, get_kafka_client):
+        client = FakeKafkaClient({('foo', 0): (100, 5000),
+                                  ('foo', 1): (200, 6000)})
+        get_kafka_client.return_value = client
+
+        offsets = self.collector.get_broker_offsets(
+            self.cluster, [spout_state(0, 1000), spout_state(1, 2000)])
+
+        self.assertEqual(offsets, {
+            ('broker.local', 'foo', 0): (100, 5000),
+            ('broker.local', 'foo', 1): (200, 6000),
+        })
+        # One request per offset time, each naming a partition only once
+        self.assertEqual([[p.time for p in payloads]
+                          for payloads in client.requests],
+                         [[-2, -2], [-1, -1]])
+
+    @patch.object(StormKafkaMonitorCollector, 'get_kafka_client')
+    def test_get_topology_summary(self, get_kafka_client):
+        get_kafka_client.return_value = FakeKafkaClient({
+            ('foo', 0): (100, 5000),
+            ('foo', 1): (200, 6000),
+        })
+
+        summary = self.collector.get_topology_summary(self.cluster, [
+            ('partition_0', spout_state(0, 1000)),
+            ('partition_1', spout_state(1, 2000, host='broker2.local')),
+        ])
+
+        self.assertEqual(summary.total_depth, 4900 + 5800)
+        self.assertEqual(summary.total_delta, 4000 + 4000)
+        self.assertEqual(summary.num_partitions, 2)
+        self.assertEqual(summary.num_brokers, 2)
+        self.assertEqual(summary.partitions[0], PartitionState(
+            'broker.local', 'foo', 0, 100, 5000, 4900, 'partition_0', 1000,
+            4000))
+
+    @patch.object(Collector, 'publish_metric')
     @patch.object(StormKafkaMonitorCollector, 'get_summaries')
     @patch.object(StormKafkaMonitorCollector, 'get_zk_client')
     def test_collect(self, zk, summaries, publish_mock):
@@ -72,7 +230,41 @@ class TestStormKafkaMonitorCollector(CollectorTestCase):
 
         self.collector.collect()
 
-        self.assertPublishedMany(publish_mock, expected_metrics)
+        self.assertDictContainsSubset(
+            expected_metrics, published(self.collector, publish_mock))
+
+    @patch.object(storm_kafka_monitor, 'IMPORT_ERROR',
+                  'No module named kafka.client')
+    @patch.object(Collector, 'publish_metric')
+    @patch.object(StormKafkaMonitorCollector, 'get_summaries')
+    def test_collect_missing_dependencies(self, summaries, publish_mock):
+        self.collector.collect()
+        self.assertFalse(summaries.called)
+
+    @patch.object(Collector, 'publish_metric')
+    @patch.object(StormKafkaMonitorCollector, 'get_summaries')
+    def test_collect_multiple_clusters(self, summaries, publish_mock):
+        config = get_collector_config('StormKafkaMonitorCollector', {
+            'clusters': {
+                'prod': {'zookeeper': 'zoo-1.prod:2181'},
+                'staging': {'zookeeper': 'zoo-1.staging:2181',
+                            'prefix': 'stage'},
+            },
+        })
+        collector = StormKafkaMonitorCollector(config, None)
+
+        partition = PartitionsSummary(1,2,0,3,[])
+        summaries.return_value = [('topo', partition)]
+
+        collector.collect()
+
+        self.assertEqual(
+            sorted((c.zookeeper, c.prefix) for c in collector.get_clusters()),
+            [('zoo-1.prod:2181', 'prod'), ('zoo-1.staging:2181', 'stage')])
+        self.assertDictContainsSubset({
+            'prod.topo.total_depth': 1,
+            'stage.topo.total_depth': 1,
+        }, published(collector, publish_mock))
 
 ###############################################################################
 if __name__ == "__main__":